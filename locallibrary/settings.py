@@ -35,6 +35,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'management.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -45,6 +46,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'simple_history.middleware.HistoryRequestMiddleware',
+    'management.history.DeferredHistoryMiddleware',
 ]
 
 ROOT_URLCONF = 'locallibrary.urls'
@@ -108,6 +110,30 @@ USE_TZ = True
 
 LOGIN_REDIRECT_URL = '/'
 
+# Only append deliveries to the stock ledger and leave adding them to Product and
+# ProductWarehouse to compact_stock_ledger, so concurrent deliveries of one product
+# do not queue on its rows. Their stock shows in ledger.stock_balances() right away,
+# but orders, transfers and the product lists read the warehouse rows, so it cannot
+# be sold or moved before the next compaction. Off by default for that reason.
+MANAGEMENT_DEFER_DELIVERY_STOCK = False
+
+# Query budgets checked by management.instrumentation.InstrumentationMiddleware,
+# per route (ViewSet.action or view name) with a default for the rest.
+# Counts include the session and user lookups of an authenticated request.
+MANAGEMENT_QUERY_BUDGET = 20
+MANAGEMENT_QUERY_BUDGETS = {
+    # One more for the first ?search= on a new SQLite connection, which checks for the FTS5 table.
+    'ProductViewSet.list': 6,
+    'OrderViewSet.list': 5,
+    'DeliveryViewSet.list': 5,
+    'CategoryViewSet.list': 5,
+    'WarehouseViewSet.list': 5,
+    'SupplierViewSet.list': 5,
+    'index': 5,
+    # Posting the delivery to the stock writes the product, warehouse row, history and rollup.
+    'DeliveryViewSet.create': 25,
+}
+
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
 # Update database configuration from $DATABASE_URL environment variable (if defined)
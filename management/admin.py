@@ -5,30 +5,51 @@ from django.contrib.auth.models import User
 from django.urls import reverse
 from django.utils.html import format_html
 from import_export import resources, fields
-from import_export.admin import ExportMixin
 from import_export.formats import base_formats
 from import_export.widgets import ForeignKeyWidget
 from simple_history.admin import SimpleHistoryAdmin
 
+from .export import StreamingExportMixin
 from .models import Product, Category, Category_Product, Warehouse, Order, Delivery, Supplier, ProductWarehouse
+from .search import ranked, search_products
 
 
 class AdminModel(SimpleHistoryAdmin, admin.ModelAdmin):
     pass
 
 
-class ProductResource(resources.ModelResource):
+class RelatedModelResource(resources.ModelResource):
+    """
+    ModelResource that loads the relations its export touches together with the rows.
+    List them in export_select_related (foreign keys) and export_prefetch_related (m2m).
+    """
+    export_select_related = ()
+    export_prefetch_related = ()
+
+    def filter_export(self, queryset, *args, **kwargs):
+        queryset = super().filter_export(queryset, *args, **kwargs)
+        if self.export_select_related:
+            queryset = queryset.select_related(*self.export_select_related)
+        if self.export_prefetch_related:
+            queryset = queryset.prefetch_related(*self.export_prefetch_related)
+        return queryset
+
+
+class ProductResource(RelatedModelResource):
+    export_prefetch_related = ('warehouses', 'categories')
 
     class Meta:
         model = Product
 
 
-class CategoryResource(resources.ModelResource):
+class CategoryResource(RelatedModelResource):
     class Meta:
         model = Category
 
 
-class OrderResource(resources.ModelResource):
+class OrderResource(RelatedModelResource):
+    export_select_related = ('product', 'user')
+
     user = fields.Field(
         column_name='user',
         attribute='user',
@@ -43,18 +64,20 @@ class OrderResource(resources.ModelResource):
 
 
 
-class DeliveryResource(resources.ModelResource):
+class DeliveryResource(RelatedModelResource):
+    export_select_related = ('product', 'supplier', 'warehouse')
+
     class Meta:
         model = Delivery
 
 
-class SupplierResource(resources.ModelResource):
+class SupplierResource(RelatedModelResource):
 
     class Meta:
         model = Supplier
 
 
-class WarehouseResource(resources.ModelResource):
+class WarehouseResource(RelatedModelResource):
 
     class Meta:
         model = Warehouse
@@ -79,7 +102,7 @@ class CategoryInline(admin.TabularInline):
 
 
 @admin.register(Product)
-class ProductAdmin(ExportMixin, AdminModel):
+class ProductAdmin(StreamingExportMixin, AdminModel):
     list_display = ('name', 'summary', 'price', 'quantity', 'get_warehouse_names')
     list_filter = ('categories', 'warehouses')
     inlines = [CategoryInline]
@@ -89,16 +112,20 @@ class ProductAdmin(ExportMixin, AdminModel):
     readonly_fields = ('get_warehouse_names',)
     resource_class = ProductResource
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('warehouses')
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        # The changelist keeps this ordering after any column the user sorts by.
+        return ranked(search_products(queryset, search_term)), False
+
     def save_model(self, request, obj, form, change):
         super().save_model(request, obj, form, change)
         warehouses = form.cleaned_data.get('warehouses')
         if warehouses is not None:
-            for warehouse in warehouses:
-                ProductWarehouse.objects.update_or_create(
-                    product=obj,
-                    warehouse=warehouse,
-                    defaults={'quantity': obj.quantity}
-                )
+            ProductWarehouse.objects.sync_product(obj, warehouses)
 
     def get_warehouse_names(self, obj):
         return ', '.join([str(warehouse) for warehouse in obj.warehouses.all()])
@@ -114,8 +141,9 @@ class ProductAdmin(ExportMixin, AdminModel):
 
 
 @admin.register(Order)
-class OrderAdmin(ExportMixin, AdminModel):
+class OrderAdmin(StreamingExportMixin, AdminModel):
     list_display = ('id', 'product_link', 'user', 'quantity', 'date', 'status')
+    list_select_related = ('product', 'user')
     list_filter = ('status', 'date')
     search_fields = ('product__name', 'user__username')
 
@@ -142,20 +170,27 @@ class OrderAdmin(ExportMixin, AdminModel):
 
 
 @admin.register(Delivery)
-class DeliveryAdmin(ExportMixin, AdminModel):
+class DeliveryAdmin(StreamingExportMixin, AdminModel):
     list_display = ('product', 'supplier', 'quantity', 'date')
+    list_select_related = ('product', 'supplier')
     list_filter = ('date',)
     resource_class = DeliveryResource
 
+    def get_readonly_fields(self, request, obj=None):
+        readonly = super().get_readonly_fields(request, obj)
+        if obj is not None and obj.posted_at is not None:
+            readonly = (*readonly, *Delivery.POSTED_FIELDS)
+        return readonly
+
 
 @admin.register(Supplier)
-class SupplierAdmin(ExportMixin, AdminModel):
+class SupplierAdmin(StreamingExportMixin, AdminModel):
     list_display = ('name', 'contact', 'address', 'tel')
     resource_class = SupplierResource
 
 
 @admin.register(Warehouse)
-class WarehouseAdmin(ExportMixin, AdminModel):
+class WarehouseAdmin(StreamingExportMixin, AdminModel):
     list_display = ('name', 'address')
     resource_class = WarehouseResource
 
@@ -163,6 +198,7 @@ class WarehouseAdmin(ExportMixin, AdminModel):
 @admin.register(ProductWarehouse)
 class ProductWarehouseAdmin(AdminModel):
     list_display = ('product', 'warehouse', 'quantity')
+    list_select_related = ('product', 'warehouse')
 
 
 admin.site.register(Category, AdminModel)
@@ -0,0 +1,108 @@
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from rest_framework import serializers, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history
+
+from .signals import post_bulk_save
+
+BULK_BATCH_SIZE = 1000
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    batch_size = BULK_BATCH_SIZE
+
+    def _prefetch_many_to_many(self, objs):
+        model = self.child.Meta.model
+        prefetch_related_objects(objs, *[field.name for field in model._meta.many_to_many])
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        objs = [model(**attrs) for attrs in validated_data]
+        with transaction.atomic():
+            objs = bulk_create_with_history(objs, model, batch_size=self.batch_size)
+            post_bulk_save.send(sender=model, instances=objs, created=True)
+        self._prefetch_many_to_many(objs)
+        return objs
+
+    def update(self, instances, validated_data):
+        model = self.child.Meta.model
+        fields = set()
+        for obj, attrs in zip(instances, validated_data):
+            for attr, value in attrs.items():
+                setattr(obj, attr, value)
+                fields.add(attr)
+        if fields:
+            with transaction.atomic():
+                bulk_update_with_history(instances, model, sorted(fields), batch_size=self.batch_size)
+                post_bulk_save.send(sender=model, instances=instances, created=False)
+        self._prefetch_many_to_many(instances)
+        return instances
+
+
+class BulkModelViewSetMixin:
+    """
+    Adds /bulk/ to a ModelViewSet: POST creates, PATCH updates and DELETE removes
+    a JSON array of objects in one transaction. The serializer must use
+    BulkListSerializer as its list_serializer_class.
+
+    POST creates the valid items even when others fail validation, and then answers
+    207 with the created objects and the errors aligned with the submitted items.
+    PATCH and DELETE apply all items or none.
+    """
+
+    def _get_bulk_instances(self, ids):
+        instances = self.get_queryset().in_bulk(ids)
+        errors = [{} if pk in instances else {'id': ['Not found.']} for pk in ids]
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return [instances[pk] for pk in ids]
+
+    def _get_bulk_ids(self, items):
+        ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False).run_validation(items)
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError({'id': ['Duplicate ids in request.']})
+        return ids
+
+    @action(methods=['POST'], detail=False)
+    def bulk(self, request):
+        return self.bulk_create(request)
+
+    def bulk_create(self, request):
+        serializer = self.get_serializer(data=request.data, many=True)
+        if serializer.is_valid():
+            self.perform_bulk_create(serializer, range(len(serializer.validated_data)))
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+        errors = serializer.errors
+        # Item errors come as a list aligned with the items; anything else rejects the request.
+        positions = [i for i, error in enumerate(errors) if not error] if isinstance(errors, list) else []
+        if not positions:
+            raise serializers.ValidationError(errors)
+        serializer = self.get_serializer(data=[request.data[i] for i in positions], many=True)
+        serializer.is_valid(raise_exception=True)
+        self.perform_bulk_create(serializer, positions)
+        return Response({'results': serializer.data, 'errors': errors}, status=status.HTTP_207_MULTI_STATUS)
+
+    def perform_bulk_create(self, serializer, positions):
+        """positions are the indexes in the request of the items the serializer creates."""
+        serializer.save()
+
+    @bulk.mapping.patch
+    def bulk_update(self, request):
+        if not isinstance(request.data, list):
+            raise serializers.ValidationError({'non_field_errors': ['Expected a list of items.']})
+        ids = self._get_bulk_ids([item.get('id') if isinstance(item, dict) else None for item in request.data])
+        serializer = self.get_serializer(self._get_bulk_instances(ids), data=request.data, many=True, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @bulk.mapping.delete
+    def bulk_destroy(self, request):
+        ids = self._get_bulk_ids(request.data)
+        instances = self._get_bulk_instances(ids)
+        with transaction.atomic():
+            self.get_queryset().filter(pk__in=[obj.pk for obj in instances]).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,92 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import Category, Supplier, Warehouse
+
+RESPONSE_CACHE_TIMEOUT = 60 * 60
+
+# Models whose ViewSets use CachedResponseMixin.
+CACHED_MODELS = (Category, Warehouse, Supplier)
+
+
+def _generation_key(model):
+    return f'management:generation:{model._meta.label_lower}'
+
+
+def get_generation(model):
+    """Counter that changes whenever a row of model is saved or deleted."""
+    key = _generation_key(model)
+    generation = cache.get(key)
+    if generation is None:
+        # Start from the clock rather than 1, so a counter evicted from the cache
+        # never comes back at a value some cached response was stored under.
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(model):
+    try:
+        cache.incr(_generation_key(model))
+    except ValueError:
+        get_generation(model)
+
+
+def bump_generation_on_commit(model):
+    # Bumped after commit: a reader between the bump and the commit would cache the old rows.
+    transaction.on_commit(lambda: bump_generation(model))
+
+
+class CachedResponseMixin:
+    """
+    Caches list and retrieve responses of a ViewSet under a key made of the request path,
+    query string, rendered format and the generation of the queryset's model (see
+    receivers.py), and answers If-None-Match with 304 before touching the database.
+    """
+    response_cache_timeout = RESPONSE_CACHE_TIMEOUT
+    # The browsable API embeds the user and a CSRF token, so it is never cached.
+    response_cache_formats = ('json',)
+
+    def _response_cache_key(self, request):
+        """Return the cache key and the ETag of the response to request."""
+        model = self.get_queryset().model
+        generation = get_generation(model)
+        query = sorted(request.query_params.lists())
+        digest = hashlib.md5(f'{request.path}|{query}|{request.accepted_renderer.format}'.encode()).hexdigest()
+        return f'management:response:{model._meta.label_lower}:{generation}:{digest}', f'"{generation}-{digest}"'
+
+    def _cached_response(self, request, handler, *args, **kwargs):
+        if request.accepted_renderer.format not in self.response_cache_formats:
+            return handler(request, *args, **kwargs)
+
+        key, etag = self._response_cache_key(request)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+            response['ETag'] = etag
+            return response
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+            response.add_post_render_callback(
+                lambda rendered: cache.set(key, (rendered.rendered_content, rendered['Content-Type']), self.response_cache_timeout)
+            )
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self._cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached_response(request, super().retrieve, *args, **kwargs)
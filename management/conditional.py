@@ -0,0 +1,83 @@
+from django.core.exceptions import ValidationError
+from django.db.models import OuterRef, Subquery
+from django.utils.cache import get_conditional_response, patch_vary_headers, quote_etag
+from django.utils.http import http_date
+
+
+def _latest(history):
+    return Subquery(history.order_by('-history_date').values('history_date')[:1])
+
+
+def history_last_modified(model, pk, related=()):
+    """
+    Latest history_date of the object pk of model and of the related history querysets
+    (correlated to it with OuterRef), in one query. None when the object does not exist,
+    pk is not a valid primary key or the object has no history.
+    """
+    subqueries = [_latest(model.history.filter(id=OuterRef('pk')))] + [_latest(history) for history in related]
+    annotations = {f'changed_{n}': subquery for n, subquery in enumerate(subqueries)}
+    try:
+        rows = model._default_manager.filter(pk=pk)
+    except (ValueError, TypeError, ValidationError):
+        # Left to the view, which answers 404 the usual way.
+        return None
+    row = rows.annotate(**annotations).values_list(*annotations).first()
+    dates = [date for date in row or () if date is not None]
+    return max(dates) if dates else None
+
+
+def conditional_response(request, model, pk, related, respond, vary=('Cookie',), variant=''):
+    """
+    Answer a GET of object pk with 304 when the client's ETag or Last-Modified, both taken
+    from the object's history, are still current; otherwise call respond() and add them.
+    The ETag includes the user, since the pages show who is logged in, and variant, which
+    tells apart representations of the same object (the API's negotiated format).
+    """
+    last_modified = history_last_modified(model, pk, related)
+    if last_modified is None:
+        return respond()
+
+    timestamp = int(last_modified.timestamp())
+    tag = f'{last_modified.timestamp():.6f}-{request.user.pk}'
+    if variant:
+        tag = f'{tag}-{variant}'
+    etag = quote_etag(tag)
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = respond()
+        if response.status_code != 200:
+            return response
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(timestamp)
+    patch_vary_headers(response, vary)
+    return response
+
+
+class ConditionalDetailMixin:
+    """DetailView mixin answering repeat requests with 304 from the object's history."""
+
+    def get_related_history(self):
+        """History querysets that also show up on the page, correlated with OuterRef."""
+        return []
+
+    def get(self, request, *args, **kwargs):
+        return conditional_response(
+            request, self.model, kwargs[self.pk_url_kwarg], self.get_related_history(),
+            lambda: super(ConditionalDetailMixin, self).get(request, *args, **kwargs),
+        )
+
+
+class ConditionalRetrieveMixin:
+    """Same as ConditionalDetailMixin for the retrieve action of a ViewSet."""
+
+    def get_related_history(self):
+        return []
+
+    def retrieve(self, request, *args, **kwargs):
+        return conditional_response(
+            request, self.get_queryset().model, kwargs[self.lookup_url_kwarg or self.lookup_field],
+            self.get_related_history(),
+            lambda: super(ConditionalRetrieveMixin, self).retrieve(request, *args, **kwargs),
+            vary=('Accept', 'Cookie', 'Authorization'),
+            variant=request.accepted_renderer.format,
+        )
@@ -0,0 +1,42 @@
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .models import Product, Category, Supplier, Order, Delivery, Warehouse
+
+DASHBOARD_COUNTS_KEY = 'management:dashboard-counts'
+DASHBOARD_COUNTS_TIMEOUT = 60 * 60
+
+COUNTED_MODELS = {
+    'num_products': Product,
+    'num_categories': Category,
+    'num_suppliers': Supplier,
+    'num_orders': Order,
+    'num_deliveries': Delivery,
+    'num_warehouses': Warehouse,
+}
+
+
+def _count_all():
+    quote = connection.ops.quote_name
+    columns = ', '.join(f'(SELECT COUNT(*) FROM {quote(model._meta.db_table)})' for model in COUNTED_MODELS.values())
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT {columns}')
+        return dict(zip(COUNTED_MODELS, cursor.fetchone()))
+
+
+def get_dashboard_counts():
+    """Row counts for the index page, from cache or one combined query on a miss."""
+    counts = cache.get(DASHBOARD_COUNTS_KEY)
+    if counts is None:
+        counts = _count_all()
+        cache.set(DASHBOARD_COUNTS_KEY, counts, DASHBOARD_COUNTS_TIMEOUT)
+    return counts
+
+
+def invalidate_dashboard_counts():
+    cache.delete(DASHBOARD_COUNTS_KEY)
+
+
+def invalidate_dashboard_counts_on_commit():
+    # Deleted after commit: a reader between the delete and the commit would cache the old counts.
+    transaction.on_commit(invalidate_dashboard_counts)
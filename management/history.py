@@ -0,0 +1,131 @@
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+from simple_history.models import HistoricalRecords
+from simple_history.signals import post_create_historical_record, pre_create_historical_record
+
+from .bulk import BULK_BATCH_SIZE
+
+_local = threading.local()
+
+
+class _HistoryBuffer:
+    def __init__(self, using):
+        self.using = using
+        self.connection = transaction.get_connection(using)
+        self.records = []
+        # ROLLBACK TO SAVEPOINT statement -> savepoint id, for the savepoints records were written under.
+        self.rollback_sql = {}
+        self.rolled_back = set()
+
+    def add(self, history_instance, instance, signal_kwargs):
+        sids = tuple(self.connection.savepoint_ids)
+        for sid in sids:
+            self.rollback_sql.setdefault(self.connection.ops.savepoint_rollback_sql(sid), sid)
+        self.records.append((sids, history_instance, instance, signal_kwargs))
+
+    def watch_rollbacks(self, execute, sql, params, many, context):
+        # Installed with connection.execute_wrapper(): notes every rolled back savepoint
+        # that records were written under, so flush() can drop those records.
+        sid = self.rollback_sql.get(sql)
+        if sid is not None:
+            self.rolled_back.add(sid)
+        return execute(sql, params, many, context)
+
+    def flush(self):
+        records = [record for record in self.records if self.rolled_back.isdisjoint(record[0])]
+        self.records, self.rollback_sql, self.rolled_back = [], {}, set()
+
+        by_model = defaultdict(list)
+        for _, history_instance, _, _ in records:
+            by_model[type(history_instance)].append(history_instance)
+        for model, rows in by_model.items():
+            model.objects.using(self.using).bulk_create(rows, batch_size=BULK_BATCH_SIZE)
+
+        for _, history_instance, instance, signal_kwargs in records:
+            post_create_historical_record.send(
+                sender=type(history_instance), instance=instance, history_instance=history_instance, **signal_kwargs,
+            )
+        return len(records)
+
+
+def _current_buffer():
+    return getattr(_local, 'buffer', None)
+
+
+@contextmanager
+def deferred_history(using=DEFAULT_DB_ALIAS):
+    """
+    Run the block in a transaction and write the history records of every save and
+    delete in it with one bulk_create per model right before the transaction commits.
+
+    The records are written inside the transaction, so they are committed together
+    with the changes they describe; records of savepoints that were rolled back are
+    dropped. Nested blocks join the outermost one.
+    """
+    if _current_buffer() is not None:
+        with transaction.atomic(using=using):
+            yield
+        return
+
+    buffer = _local.buffer = _HistoryBuffer(using)
+    try:
+        with buffer.connection.execute_wrapper(buffer.watch_rollbacks):
+            with transaction.atomic(using=using):
+                yield
+                buffer.flush()
+    finally:
+        _local.buffer = None
+
+
+class DeferredHistoricalRecords(HistoricalRecords):
+    """HistoricalRecords that hands new records to deferred_history() when one is active."""
+
+    def create_historical_record(self, instance, history_type, using=None):
+        buffer = _current_buffer()
+        if buffer is None or self.m2m_fields or (instance._state.db or DEFAULT_DB_ALIAS) != buffer.using:
+            return super().create_historical_record(instance, history_type, using=using)
+
+        using = using if self.use_base_model_db else None
+        history_date = getattr(instance, '_history_date', timezone.now())
+        history_user = self.get_history_user(instance)
+        history_change_reason = self.get_change_reason_for_object(instance, history_type, using)
+        manager = getattr(instance, self.manager_name)
+
+        attrs = {field.attname: getattr(instance, field.attname) for field in self.fields_included(instance)}
+        if getattr(manager.model, 'history_relation', None) is not None:
+            attrs['history_relation'] = instance
+
+        history_instance = manager.model(
+            history_date=history_date,
+            history_type=history_type,
+            history_user=history_user,
+            history_change_reason=history_change_reason,
+            **attrs,
+        )
+        signal_kwargs = {
+            'history_date': history_date,
+            'history_user': history_user,
+            'history_change_reason': history_change_reason,
+            'using': using,
+        }
+        pre_create_historical_record.send(
+            sender=manager.model, instance=instance, history_instance=history_instance, **signal_kwargs,
+        )
+        buffer.add(history_instance, instance, signal_kwargs)
+
+
+class DeferredHistoryMiddleware:
+    """Wrap every unsafe request in deferred_history(), so its history is written in bulk."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD', 'OPTIONS', 'TRACE'):
+            return self.get_response(request)
+        with deferred_history():
+            return self.get_response(request)
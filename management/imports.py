@@ -0,0 +1,232 @@
+import csv
+import itertools
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+import openpyxl
+from django.core.exceptions import ValidationError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+from import_export.widgets import ForeignKeyWidget, ManyToManyWidget
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history
+
+from .signals import post_bulk_save
+
+
+class BulkImportResult:
+    def __init__(self):
+        self.new = 0
+        self.updated = 0
+        self.skipped = 0
+        self.errors = []
+        self.diff = []
+
+    @property
+    def has_errors(self):
+        return bool(self.errors)
+
+
+def read_rows(path):
+    """Yield rows of a CSV or XLSX file as dicts without loading the whole file."""
+    if str(path).endswith('.xlsx'):
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            headers = [str(header) for header in next(rows, ())]
+            for values in rows:
+                yield dict(zip(headers, values))
+        finally:
+            workbook.close()
+    else:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            yield from csv.DictReader(f)
+
+
+def _import_fields(resource):
+    return [
+        field for field in resource.get_import_fields()
+        if field.attribute and '__' not in field.attribute and not isinstance(field.widget, ManyToManyWidget)
+    ]
+
+
+def _resolve_foreign_keys(fields, rows):
+    """Look up every foreign key value of the chunk with one query per field."""
+    lookups = {}
+    for field in fields:
+        if not isinstance(field.widget, ForeignKeyWidget):
+            continue
+        raw = {str(row[field.column_name]) for row in rows if row.get(field.column_name) not in (None, '')}
+        queryset = field.widget.get_queryset(None, {}).filter(**{f'{field.widget.field}__in': raw})
+        lookups[field.column_name] = {str(key): pk for key, pk in queryset.values_list(field.widget.field, 'pk')}
+    return lookups
+
+
+def clean_chunk(resource_path, start, rows):
+    """
+    Validate a chunk of rows, returning (row_number, values, errors) for each.
+
+    values maps model attnames to cleaned values for the columns present in the row.
+    Runs in worker processes, so it only takes and returns picklable data.
+    """
+    resource = import_string(resource_path)()
+    model = resource._meta.model
+    fields = _import_fields(resource)
+    lookups = _resolve_foreign_keys(fields, rows)
+
+    cleaned = []
+    for number, row in enumerate(rows, start):
+        obj = model()
+        errors = {}
+        present = []
+        for field in fields:
+            if field.column_name not in row:
+                continue
+            model_field = model._meta.get_field(field.attribute)
+            present.append(model_field)
+            try:
+                if field.column_name in lookups:
+                    value = row[field.column_name]
+                    if value in (None, ''):
+                        setattr(obj, model_field.attname, None)
+                    elif str(value) in lookups[field.column_name]:
+                        setattr(obj, model_field.attname, lookups[field.column_name][str(value)])
+                    else:
+                        raise ValueError(f'{model_field.related_model.__name__} "{value}" does not exist.')
+                else:
+                    field.save(obj, row)
+            except ValueError as e:
+                errors[field.attribute] = [str(e)]
+            except (ArithmeticError, TypeError, ValidationError):
+                errors[field.attribute] = [f'Invalid value "{row[field.column_name]}".']
+
+        if not errors:
+            try:
+                obj.full_clean(exclude=[f.name for f in present if f.is_relation], validate_unique=False)
+            except ValidationError as e:
+                errors = e.message_dict
+
+        values = {f.attname: f.value_from_object(obj) for f in present}
+        cleaned.append((number, values, errors))
+    return cleaned
+
+
+def _chunks(rows, chunk_size):
+    rows = iter(rows)
+    start = 1
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield start, chunk
+        start += len(chunk)
+
+
+def _cleaned_chunks(resource_path, rows, chunk_size, workers):
+    if workers <= 1:
+        for start, chunk in _chunks(rows, chunk_size):
+            yield clean_chunk(resource_path, start, chunk)
+        return
+
+    # Spawned rather than forked workers, so they open their own database connections
+    # instead of inheriting the one holding the import transaction. They only see
+    # committed data, which is all that foreign key lookups need.
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=django.setup) as pool:
+        pending = deque()
+        for start, chunk in _chunks(rows, chunk_size):
+            pending.append(pool.submit(clean_chunk, resource_path, start, chunk))
+            # Keep a bounded number of chunks in flight so the file is never fully in memory.
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _persist_chunk(model, cleaned, result, dry_run, skip_errors, user, seen, collect_diff):
+    pk_name = model._meta.pk.attname
+    valid = []
+    for number, values, errors in cleaned:
+        pk = values.get(pk_name)
+        if not errors and pk is not None:
+            # A second row with the same id would insert it twice or update it twice in one batch.
+            if pk in seen:
+                errors = {pk_name: [f'Duplicate of row {seen[pk]}.']}
+            else:
+                seen[pk] = number
+        if errors:
+            result.errors.append((number, errors))
+        else:
+            valid.append((number, values))
+
+    existing = model._default_manager.in_bulk([values[pk_name] for _, values in valid if values.get(pk_name) is not None])
+
+    new, changed, update_fields = [], [], set()
+    for number, values in valid:
+        current = existing.get(values.get(pk_name))
+        if current is None:
+            new.append(model(**values))
+            result.new += 1
+            if collect_diff:
+                result.diff.append((number, 'new', values))
+            continue
+
+        diff = {
+            name: (getattr(current, name), value)
+            for name, value in values.items()
+            if name != pk_name and getattr(current, name) != value
+        }
+        if not diff:
+            result.skipped += 1
+            continue
+        for name, (_, value) in diff.items():
+            setattr(current, name, value)
+        changed.append(current)
+        update_fields.update(diff)
+        result.updated += 1
+        if collect_diff:
+            result.diff.append((number, 'update', diff))
+
+    # Once a row has failed the import will be rolled back, so only the counts and the diff are still collected.
+    if dry_run or (result.has_errors and not skip_errors):
+        return
+    if new:
+        objs = bulk_create_with_history(new, model, default_user=user)
+        post_bulk_save.send(sender=model, instances=objs, created=True)
+    if changed:
+        bulk_update_with_history(changed, model, sorted(update_fields), default_user=user)
+        post_bulk_save.send(sender=model, instances=changed, created=False)
+
+
+def bulk_import(resource_class, rows, chunk_size=1000, workers=1, dry_run=False, skip_errors=False, user=None, diff=False):
+    """
+    Import rows through resource_class in chunks.
+
+    Rows are validated chunk by chunk (in a process pool when workers > 1) and written
+    with bulk_create/bulk_update plus bulk history records. A row repeating the id of an
+    earlier row fails like an invalid one. Everything runs in one transaction which is
+    rolled back on dry runs and, unless skip_errors is set, when any row fails.
+
+    result.diff lists the new and changed rows only with diff=True: it holds the values
+    of every imported row, which for a large file is as big as the file itself.
+    """
+    resource_path = f'{resource_class.__module__}.{resource_class.__qualname__}'
+    model = resource_class._meta.model
+    result = BulkImportResult()
+
+    # Row number of every id imported so far, to report rows repeating one.
+    seen = {}
+    with transaction.atomic():
+        for cleaned in _cleaned_chunks(resource_path, rows, chunk_size, workers):
+            _persist_chunk(model, cleaned, result, dry_run, skip_errors, user, seen, diff)
+
+        if dry_run or (result.has_errors and not skip_errors):
+            transaction.set_rollback(True)
+        elif result.new:
+            # Rows imported with explicit ids leave the pk sequence behind on Postgres.
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [model]):
+                    cursor.execute(sql)
+    return result
@@ -0,0 +1,194 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Samples kept per route for the percentiles.
+WINDOW = 1000
+QUANTILES = (0.5, 0.95, 0.99)
+METRICS = ('total_seconds', 'sql_seconds', 'serialize_seconds', 'render_seconds', 'queries')
+
+
+def route_name(request):
+    """ViewSet.action for DRF views, the view class or function name otherwise."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    view = match.func
+    actions = getattr(view, 'actions', None)
+    if actions:
+        return f'{view.cls.__name__}.{actions.get(request.method.lower(), request.method.lower())}'
+    view_class = getattr(view, 'view_class', None) or getattr(view, 'cls', None)
+    return view_class.__name__ if view_class else view.__name__
+
+
+def _quantile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class RouteStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+
+    def record(self, route, **sample):
+        with self.lock:
+            stats = self.routes.get(route)
+            if stats is None:
+                stats = self.routes[route] = {'count': 0, 'over_budget': 0, **{name: deque(maxlen=WINDOW) for name in METRICS}}
+            stats['count'] += 1
+            stats['over_budget'] += sample.pop('over_budget')
+            for name, value in sample.items():
+                stats[name].append(value)
+
+    def snapshot(self):
+        """{route: {'count', 'over_budget', metric: {quantile: value}}} over the last WINDOW requests."""
+        with self.lock:
+            routes = {route: {name: list(value) if name in METRICS else value for name, value in stats.items()}
+                      for route, stats in self.routes.items()}
+        return {
+            route: {
+                'count': stats['count'],
+                'over_budget': stats['over_budget'],
+                **{name: {q: _quantile(stats[name], q) for q in QUANTILES} for name in METRICS},
+            }
+            for route, stats in sorted(routes.items())
+        }
+
+    def reset(self):
+        with self.lock:
+            self.routes.clear()
+
+
+route_stats = RouteStats()
+
+
+def query_budget(route):
+    """Most queries a request to route may run: MANAGEMENT_QUERY_BUDGETS[route] or MANAGEMENT_QUERY_BUDGET."""
+    budgets = getattr(settings, 'MANAGEMENT_QUERY_BUDGETS', {})
+    return budgets.get(route, getattr(settings, 'MANAGEMENT_QUERY_BUDGET', None))
+
+
+class _SQLTimer:
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.queries += 1
+
+
+class _Stopwatch:
+    def __init__(self):
+        self.seconds = 0.0
+
+    def wrap(self, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.seconds += time.perf_counter() - start
+        return timed
+
+
+class SerializationTimingMixin:
+    """
+    ViewSet mixin that adds the time its serializers and FastRepresentation spend turning
+    objects into response data to the request's serialize_seconds. That includes the
+    queries they run themselves, such as lazily loaded relations.
+    """
+
+    def _serialization_stopwatch(self):
+        return getattr(self.request, '_instrumentation_serialization', None)
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        stopwatch = self._serialization_stopwatch()
+        if stopwatch is not None:
+            # Serializer.data calls self.to_representation; with many=True that is the
+            # ListSerializer's, which covers every item.
+            serializer.to_representation = stopwatch.wrap(serializer.to_representation)
+        return serializer
+
+    def get_fast_representation(self):
+        representation = super().get_fast_representation()
+        stopwatch = self._serialization_stopwatch()
+        if stopwatch is not None:
+            representation.to_representation = stopwatch.wrap(representation.to_representation)
+        return representation
+
+
+class InstrumentationMiddleware:
+    """
+    Records per route in route_stats the total time, SQL query count and time, the
+    serialization time (see SerializationTimingMixin) and the render time (turning the
+    response data into bytes, which for the API is the JSON encoding) of every request,
+    and logs a warning when a route runs more queries than its budget.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = _SQLTimer()
+        serialization = request._instrumentation_serialization = _Stopwatch()
+        request._instrumentation_view_end = None
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        end = time.perf_counter()
+
+        route = route_name(request)
+        if route is None:
+            return response
+
+        view_end = request._instrumentation_view_end
+        budget = query_budget(route)
+        over_budget = budget is not None and timer.queries > budget
+        if over_budget:
+            logger.warning('%s %s ran %d queries, over its budget of %d', request.method, route, timer.queries, budget)
+        route_stats.record(
+            route,
+            total_seconds=end - start,
+            sql_seconds=timer.seconds,
+            serialize_seconds=serialization.seconds,
+            render_seconds=end - view_end if view_end is not None else 0.0,
+            queries=timer.queries,
+            over_budget=over_budget,
+        )
+        return response
+
+    def process_template_response(self, request, response):
+        # Called after the view returned and before the response is rendered.
+        request._instrumentation_view_end = time.perf_counter()
+        return response
+
+
+def prometheus_text(snapshot):
+    lines = []
+    for name in METRICS:
+        metric = f'management_request_{name}'
+        lines.append(f'# TYPE {metric} summary')
+        for route, stats in snapshot.items():
+            for q, value in stats[name].items():
+                lines.append(f'{metric}{{route="{route}",quantile="{q}"}} {value}')
+            lines.append(f'{metric}_count{{route="{route}"}} {stats["count"]}')
+    lines.append('# TYPE management_request_over_query_budget_total counter')
+    for route, stats in snapshot.items():
+        lines.append(f'management_request_over_query_budget_total{{route="{route}"}} {stats["over_budget"]}')
+    return '\n'.join(lines) + '\n'
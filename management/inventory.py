@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+
+from .models import Category
+
+
+def category_totals(per_warehouse=False, category_ids=None, using='default'):
+    """
+    Total stock per category (and optionally per warehouse) in one grouped query.
+
+    Returns a list of dicts with category_id, category, total_quantity and, when
+    per_warehouse is set, warehouse_id and warehouse.
+    """
+    queryset = Category.objects.using(using)
+    if category_ids is not None:
+        queryset = queryset.filter(pk__in=category_ids)
+
+    columns = {'category_id': F('pk'), 'category': F('name')}
+    if per_warehouse:
+        queryset = queryset.filter(products__productwarehouse__isnull=False)
+        columns.update(
+            warehouse_id=F('products__productwarehouse__warehouse'),
+            warehouse=F('products__productwarehouse__warehouse__name'),
+        )
+
+    return list(
+        queryset.values(**columns)
+        .annotate(total_quantity=Coalesce(Sum('products__productwarehouse__quantity'), 0))
+        .order_by(*columns)
+    )
+
+
+def _shard_totals(totals, using, **kwargs):
+    try:
+        return totals(using=using, **kwargs)
+    finally:
+        connections[using].close()
+
+
+def sharded_category_totals(databases, totals=category_totals, **kwargs):
+    """Run totals (category_totals by default) on every database alias in parallel and add the results up."""
+    with ThreadPoolExecutor(max_workers=len(databases)) as pool:
+        results = pool.map(lambda using: _shard_totals(totals, using, **kwargs), databases)
+
+        merged = {}
+        for rows in results:
+            for row in rows:
+                key = (row['category_id'], row.get('warehouse_id'))
+                if key in merged:
+                    merged[key]['total_quantity'] += row['total_quantity']
+                else:
+                    merged[key] = dict(row)
+    return [merged[key] for key in sorted(merged, key=lambda key: (key[0], key[1] or 0))]
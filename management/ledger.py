@@ -0,0 +1,130 @@
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.utils import timezone
+
+from .bulk import BULK_BATCH_SIZE
+from .models import ProductWarehouse, StockMovement, StockSnapshot
+
+
+def record_movements(deltas, kind, deferred=False):
+    """Append a StockMovement for every non-zero {(product_id, warehouse_id): delta}."""
+    movements = [
+        StockMovement(product_id=product_id, warehouse_id=warehouse_id, quantity=delta, kind=kind, deferred=deferred)
+        for (product_id, warehouse_id), delta in deltas.items() if delta
+    ]
+    StockMovement.objects.bulk_create(movements, batch_size=BULK_BATCH_SIZE)
+    return len(movements)
+
+
+def claim_unfolded(batch_size):
+    """
+    Mark up to batch_size unfolded movements, oldest first, as folded and return them as
+    (product_id, warehouse_id, quantity, deferred) tuples. Must be called inside
+    transaction.atomic(); rows locked by a concurrent compaction are skipped.
+    """
+    movements = StockMovement.objects.filter(folded_at__isnull=True).order_by('pk')
+    if connection.features.has_select_for_update_skip_locked:
+        movements = movements.select_for_update(skip_locked=True)
+    rows = list(movements.values_list('pk', 'product_id', 'warehouse_id', 'quantity', 'deferred')[:batch_size])
+    if rows:
+        StockMovement.objects.filter(pk__in=[pk for pk, *_ in rows]).update(folded_at=timezone.now())
+    return [row[1:] for row in rows]
+
+
+def fold_into_snapshots(deltas):
+    """Add {(product_id, warehouse_id): delta} to StockSnapshot, creating missing rows."""
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    StockSnapshot.objects.bulk_create(
+        [StockSnapshot(product_id=product_id, warehouse_id=warehouse_id) for product_id, warehouse_id in deltas],
+        batch_size=BULK_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    snapshots = StockSnapshot.objects.filter(
+        product_id__in={product_id for product_id, _ in deltas},
+        warehouse_id__in={warehouse_id for _, warehouse_id in deltas},
+    )
+    amounts = {
+        pk: deltas[product_id, warehouse_id]
+        for pk, product_id, warehouse_id in snapshots.values_list('pk', 'product_id', 'warehouse_id')
+        if (product_id, warehouse_id) in deltas
+    }
+    amount = Case(*[When(pk=pk, then=Value(delta)) for pk, delta in amounts.items()], default=Value(0))
+    StockSnapshot.objects.filter(pk__in=amounts).update(quantity=F('quantity') + amount, updated_at=timezone.now())
+
+
+def stock_balances(product_ids=None, warehouse_ids=None):
+    """
+    Return {(product_id, warehouse_id): quantity}: the snapshot plus the movements that
+    are not folded into it yet, deferred deliveries included.
+
+    Both parts are read in one UNION ALL statement, so a compaction committing in between
+    cannot count a movement twice or not at all.
+    """
+    snapshots = StockSnapshot.objects.all()
+    movements = StockMovement.objects.filter(folded_at__isnull=True)
+    if product_ids is not None:
+        snapshots = snapshots.filter(product_id__in=product_ids)
+        movements = movements.filter(product_id__in=product_ids)
+    if warehouse_ids is not None:
+        snapshots = snapshots.filter(warehouse_id__in=warehouse_ids)
+        movements = movements.filter(warehouse_id__in=warehouse_ids)
+    pending = movements.values('product_id', 'warehouse_id').annotate(total=Sum('quantity')).order_by()
+    rows = snapshots.values_list('product_id', 'warehouse_id', 'quantity').union(
+        pending.values_list('product_id', 'warehouse_id', 'total'), all=True,
+    )
+    balances = defaultdict(int)
+    for product_id, warehouse_id, quantity in rows:
+        balances[product_id, warehouse_id] += quantity
+    return dict(balances)
+
+
+def _deferred_deltas():
+    deferred = StockMovement.objects.filter(folded_at__isnull=True, deferred=True)
+    return {
+        (row['product_id'], row['warehouse_id']): row['total']
+        for row in deferred.values('product_id', 'warehouse_id').annotate(total=Sum('quantity')).order_by()
+    }
+
+
+def _expected_balances():
+    expected = defaultdict(int, {
+        (product_id, warehouse_id): quantity
+        for product_id, warehouse_id, quantity in ProductWarehouse.objects.values_list('product_id', 'warehouse_id', 'quantity')
+    })
+    for key, delta in _deferred_deltas().items():
+        expected[key] += delta
+    return expected
+
+
+def rebuild_snapshots():
+    """
+    Reset StockSnapshot to the ProductWarehouse quantities and mark the movements they
+    already contain as folded. Deferred movements stay pending on top of the snapshot.
+    """
+    with transaction.atomic():
+        StockMovement.objects.filter(folded_at__isnull=True, deferred=False).update(folded_at=timezone.now())
+        StockSnapshot.objects.all().delete()
+        rows = StockSnapshot.objects.bulk_create(
+            (StockSnapshot(product_id=product_id, warehouse_id=warehouse_id, quantity=quantity)
+             for product_id, warehouse_id, quantity in ProductWarehouse.objects.values_list('product_id', 'warehouse_id', 'quantity')),
+            batch_size=BULK_BATCH_SIZE,
+        )
+    return len(rows)
+
+
+def check_ledger():
+    """
+    Return {(product_id, warehouse_id): (balance, expected)} for every pair whose ledger
+    balance differs from its ProductWarehouse quantity plus the pending deferred deliveries.
+    """
+    balances = stock_balances()
+    expected = _expected_balances()
+    return {
+        key: (balances.get(key, 0), expected.get(key, 0))
+        for key in balances.keys() | expected.keys()
+        if balances.get(key, 0) != expected.get(key, 0)
+    }
@@ -0,0 +1,31 @@
+import time
+
+from django.db import connection
+from rest_framework.test import APIClient
+
+
+def benchmark_client(user=None):
+    # 127.0.0.1 is in ALLOWED_HOSTS; a non-internal REMOTE_ADDR keeps debug_toolbar out of the timings.
+    client = APIClient(SERVER_NAME='127.0.0.1', REMOTE_ADDR='10.255.255.1')
+    if user is not None:
+        client.force_authenticate(user)
+    return client
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def timed(func, *args, **kwargs):
+    """Run func, returning (result, seconds, number of SQL queries)."""
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+    return result, elapsed, counter.count
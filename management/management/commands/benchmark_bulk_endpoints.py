@@ -0,0 +1,41 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ._private import benchmark_client, timed
+
+
+class Command(BaseCommand):
+    help = 'Compares single-object POSTs with the /bulk/ endpoint of the products API. Changes are rolled back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000, help='Number of products to create per run')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        payload = [
+            {'name': f'Benchmark product {i}', 'summary': 'benchmark', 'price': '9.99', 'quantity': i}
+            for i in range(count)
+        ]
+
+        with transaction.atomic():
+            client = benchmark_client(User.objects.create(username='benchmark-bulk-endpoints'))
+
+            def post_single():
+                for item in payload:
+                    client.post('/management/api/products/', item, format='json')
+
+            def post_bulk():
+                return client.post('/management/api/products/bulk/', payload, format='json')
+
+            _, single_time, single_queries = timed(post_single)
+            response, bulk_time, bulk_queries = timed(post_bulk)
+            transaction.set_rollback(True)
+
+        if response.status_code != 201:
+            self.stdout.write(self.style.ERROR(f'Bulk request failed with {response.status_code}: {response.content[:200]}'))
+            return
+
+        self.stdout.write(f'single POST: {count} objects in {single_time:.3f}s, {single_queries} queries')
+        self.stdout.write(f'bulk POST:   {count} objects in {bulk_time:.3f}s, {bulk_queries} queries')
+        self.stdout.write(self.style.SUCCESS(f'Speedup: {single_time / bulk_time:.1f}x'))
@@ -0,0 +1,55 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from management.admin import OrderResource, DeliveryResource
+from management.models import Product, Supplier, Order, Delivery
+
+from ._private import timed
+
+
+class Command(BaseCommand):
+    help = 'Times admin resource exports of a synthetic dataset with and without related-field loading. Changes are rolled back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10000, help='Number of orders and deliveries to export')
+        parser.add_argument('--products', type=int, default=100, help='Number of distinct products referenced')
+
+    def handle(self, *args, **options):
+        count = options['count']
+
+        with transaction.atomic():
+            users = User.objects.bulk_create(User(username=f'benchmark-export-{i}') for i in range(10))
+            supplier = Supplier.objects.create(name='Benchmark', contact='-', address='-', tel='-')
+            products = Product.objects.bulk_create(
+                Product(name=f'Benchmark product {i}', summary='benchmark', price=i, quantity=i)
+                for i in range(options['products'])
+            )
+            Order.objects.bulk_create(
+                (Order(product=products[i % len(products)], user=users[i % len(users)], quantity=1, status='DELIVERED')
+                 for i in range(count)),
+                batch_size=1000,
+            )
+            Delivery.objects.bulk_create(
+                (Delivery(product=products[i % len(products)], supplier=supplier, quantity=1, date='2024-01-01')
+                 for i in range(count)),
+                batch_size=1000,
+            )
+
+            for resource_class, queryset in (
+                (OrderResource, Order.objects.filter(user__in=users)),
+                (DeliveryResource, Delivery.objects.filter(supplier=supplier)),
+            ):
+                plain = resource_class()
+                plain.export_select_related = plain.export_prefetch_related = ()
+                _, before, before_queries = timed(plain.export, queryset=queryset)
+                _, after, after_queries = timed(resource_class().export, queryset=queryset)
+                self.stdout.write(
+                    f'{resource_class.__name__}: {count} rows, '
+                    f'before {before:.3f}s / {before_queries} queries, '
+                    f'after {after:.3f}s / {after_queries} queries'
+                )
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS('Done'))
@@ -0,0 +1,55 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from management.models import Product
+from management.search import search_products
+
+from ._private import timed
+
+SYLLABLES = ['ка', 'ро', 'ми', 'ст', 'ол', 'ла', 'мп', 'ба', 'ze', 'ro', 'ti', 'ga', 'mo', 'ne', 'lu', 'vi']
+
+
+class Command(BaseCommand):
+    help = 'Compares full-text product search with icontains on a synthetic catalog. Changes are rolled back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100000, help='Number of synthetic products')
+        parser.add_argument('--vocabulary', type=int, default=20000, help='Number of distinct words in the catalog')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per search term')
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        words = list({''.join(rng.choices(SYLLABLES, k=rng.randint(2, 5))) for _ in range(options['vocabulary'])})
+        terms = [rng.choice(words) for _ in range(3)] + [' '.join(rng.sample(words[:50], 2))]
+
+        with transaction.atomic():
+            Product.objects.bulk_create(
+                (Product(
+                    name=' '.join(rng.choices(words, k=3)),
+                    summary=' '.join(rng.choices(words, k=12)),
+                    price=rng.randint(1, 1000),
+                    quantity=rng.randint(0, 100),
+                ) for _ in range(options['count'])),
+                batch_size=5000,
+            )
+            products = Product.objects.all()
+
+            for term in terms:
+                icontains = products
+                for word in term.split():
+                    icontains = icontains.filter(Q(name__icontains=word) | Q(summary__icontains=word))
+
+                results = {}
+                for label, queryset in (('icontains', icontains), ('full-text', search_products(products, term))):
+                    runs = [timed(list, queryset.values_list('pk', flat=True)) for _ in range(options['repeat'])]
+                    results[label] = (min(elapsed for _, elapsed, _ in runs), len(runs[0][0]))
+
+                self.stdout.write(
+                    f'"{term}": icontains {results["icontains"][0] * 1000:.1f}ms ({results["icontains"][1]} rows), '
+                    f'full-text {results["full-text"][0] * 1000:.1f}ms ({results["full-text"][1]} rows)'
+                )
+
+            transaction.set_rollback(True)
@@ -0,0 +1,66 @@
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from rest_framework.renderers import JSONRenderer
+
+from management.fast import FastRepresentation
+from management.serializers import (
+    CategorySerializer, DeliverySerializer, OrderSerializer, ProductSerializer, SupplierSerializer, WarehouseSerializer,
+)
+
+from ._private import timed
+from .seed_benchmark_data import seed_data
+
+SERIALIZERS = [
+    ProductSerializer, OrderSerializer, DeliverySerializer, CategorySerializer, WarehouseSerializer, SupplierSerializer,
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the DRF serializers with FastRepresentation on synthetic data and checks that both '
+        'render byte-identical JSON. Changes are rolled back'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=5000, help='Rows per model')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per serializer')
+
+    def handle(self, *args, **options):
+        renderer = JSONRenderer()
+
+        with transaction.atomic():
+            count = options['count']
+            seed_data(random.Random(0), products=count, suppliers=count, orders=count, deliveries=count, categories=50, users=10)
+
+            for serializer_class in SERIALIZERS:
+                model = serializer_class.Meta.model
+                queryset = model.objects.order_by('pk')[:options['count']]
+                many_to_many = [field.name for field in model._meta.many_to_many]
+
+                def drf():
+                    objs = list(queryset)
+                    prefetch_related_objects(objs, *many_to_many)
+                    return serializer_class(objs, many=True).data
+
+                def fast():
+                    representation = FastRepresentation(serializer_class())
+                    return representation.to_representation(representation.values(queryset))
+
+                results = {}
+                for label, func in (('drf', drf), ('fast', fast)):
+                    runs = [timed(func) for _ in range(options['repeat'])]
+                    results[label] = (min(elapsed for _, elapsed, _ in runs), runs[0][2], renderer.render(runs[0][0]))
+
+                if results['drf'][2] != results['fast'][2]:
+                    raise CommandError(f'{serializer_class.__name__}: fast JSON differs from the serializer output')
+                self.stdout.write(
+                    f'{serializer_class.__name__}: {len(results["drf"][2])} bytes, '
+                    f'serializer {results["drf"][0] * 1000:.1f}ms ({results["drf"][1]} queries), '
+                    f'fast {results["fast"][0] * 1000:.1f}ms ({results["fast"][1]} queries), '
+                    f'{results["drf"][0] / results["fast"][0]:.1f}x'
+                )
+
+            transaction.set_rollback(True)
@@ -0,0 +1,79 @@
+import random
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from management.models import ProductWarehouse
+from management.stock import stock_as_of
+
+from ._private import timed
+
+
+def scan_as_of(when, product_ids):
+    """The by-hand way: read every record up to when and keep the latest per row."""
+    latest = {}
+    rows = ProductWarehouse.history.filter(history_date__lte=when, product_id__in=product_ids).values_list(
+        'id', 'history_date', 'history_id', 'product_id', 'warehouse_id', 'quantity', 'history_type',
+    )
+    for pk, history_date, history_id, *row in rows:
+        if pk not in latest or (history_date, history_id) > latest[pk][0]:
+            latest[pk] = ((history_date, history_id), row)
+    return {
+        (product_id, warehouse_id): quantity
+        for _, (product_id, warehouse_id, quantity, history_type) in latest.values()
+        if history_type != '-'
+    }
+
+
+class Command(BaseCommand):
+    help = 'Times stock_as_of against scanning the ProductWarehouse history on a synthetic history table. Changes are rolled back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000_000, help='Number of synthetic history records')
+        parser.add_argument('--products', type=int, default=10000, help='Number of products in the history')
+        parser.add_argument('--warehouses', type=int, default=10, help='Number of warehouses per product')
+        parser.add_argument('--batch', type=int, default=100, help='Products per batch lookup')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per lookup')
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        history = ProductWarehouse.history.model
+        pairs = [(product, warehouse) for product in range(1, options['products'] + 1) for warehouse in range(1, options['warehouses'] + 1)]
+        now = timezone.now()
+        span = timedelta(days=365).total_seconds()
+
+        def records():
+            for n in range(options['rows']):
+                pk = n % len(pairs)
+                product_id, warehouse_id = pairs[pk]
+                yield history(
+                    id=pk + 1, product_id=product_id, warehouse_id=warehouse_id, quantity=rng.randint(0, 1000),
+                    history_date=now - timedelta(seconds=rng.random() * span),
+                    history_type='+' if n < len(pairs) else '~',
+                )
+
+        with transaction.atomic():
+            history.objects.bulk_create(records(), batch_size=10000)
+            self.stdout.write(f'{options["rows"]} history records for {len(pairs)} warehouse rows')
+
+            when = now - timedelta(days=180)
+            products = rng.sample(range(1, options['products'] + 1), min(options['batch'], options['products']))
+            lookups = (
+                ('one product', products[:1]),
+                (f'{len(products)} products', products),
+            )
+            for label, product_ids in lookups:
+                results = {}
+                for name, func in (('scan', scan_as_of), ('stock_as_of', stock_as_of)):
+                    runs = [timed(func, when, product_ids) for _ in range(options['repeat'])]
+                    results[name] = (min(elapsed for _, elapsed, _ in runs), runs[0][0])
+                if results['scan'][1] != results['stock_as_of'][1]:
+                    raise CommandError(f'{label}: stock_as_of does not match the scan')
+                self.stdout.write(
+                    f'{label}: scan {results["scan"][0] * 1000:.1f}ms, '
+                    f'stock_as_of {results["stock_as_of"][0] * 1000:.1f}ms ({len(results["scan"][1])} rows)'
+                )
+
+            transaction.set_rollback(True)
@@ -0,0 +1,61 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from management.admin import ProductResource, DeliveryResource
+from management.imports import bulk_import, read_rows
+
+RESOURCES = {
+    'products': ProductResource,
+    'deliveries': DeliveryResource,
+}
+
+
+class Command(BaseCommand):
+    help = 'Imports a CSV or XLSX file through an admin resource in validated, bulk-written chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('resource', choices=sorted(RESOURCES), help='Resource to import')
+        parser.add_argument('path', help='Path to a .csv or .xlsx file')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows per validation and write batch')
+        parser.add_argument('--workers', type=int, default=1, help='Processes used to validate chunks')
+        parser.add_argument('--dry-run', action='store_true', help='Report the changes without saving them')
+        parser.add_argument('--skip-errors', action='store_true', help='Save valid rows even if some rows fail')
+        parser.add_argument('--user', help='Username recorded as history_user')
+        parser.add_argument('--diff', action='store_true', help='Print every new and changed row')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f'User "{options["user"]}" does not exist')
+
+        result = bulk_import(
+            RESOURCES[options['resource']],
+            read_rows(options['path']),
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+            dry_run=options['dry_run'],
+            skip_errors=options['skip_errors'],
+            user=user,
+            diff=options['diff'],
+        )
+
+        if options['diff']:
+            for number, kind, values in result.diff:
+                if kind == 'new':
+                    self.stdout.write(f'row {number}: new {values}')
+                else:
+                    changes = ', '.join(f'{name}: {old!r} -> {new!r}' for name, (old, new) in values.items())
+                    self.stdout.write(f'row {number}: update {changes}')
+        for number, errors in result.errors:
+            self.stdout.write(self.style.ERROR(f'row {number}: {errors}'))
+
+        summary = f'new: {result.new}, updated: {result.updated}, unchanged: {result.skipped}, errors: {len(result.errors)}'
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'Dry run, nothing saved. {summary}'))
+        elif result.has_errors and not options['skip_errors']:
+            self.stdout.write(self.style.ERROR(f'Import rolled back. {summary}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Imported. {summary}'))
@@ -1,26 +1,67 @@
-from django.core.management.base import BaseCommand
-from management.models import Category, ProductWarehouse
-from django.db.models import Sum
+import csv
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from management.inventory import category_totals, sharded_category_totals
+from management.models import Category, StockRollup
+from management.rollup import rollup_category_totals
 
 
 
 class Command(BaseCommand):
-    help = 'Prints the total quantity of products in the warehouse for a given category'
+    help = 'Prints the total quantity of products in the warehouse for a given category, or for all categories with --all'
 
     def add_arguments(self, parser):
-        parser.add_argument('category_id', type=int, help='ID of the category')
+        parser.add_argument('category_id', type=int, nargs='?', help='ID of the category')
+        parser.add_argument('--all', action='store_true', help='Report every category in one grouped query')
+        parser.add_argument('--per-warehouse', action='store_true', help='Split --all totals by warehouse')
+        parser.add_argument('--format', choices=['text', 'json', 'csv'], default='text', help='Output format for --all')
+        parser.add_argument(
+            '--parallel', action='store_true',
+            help='Query every configured database in parallel and add the totals up (for sharded setups)',
+        )
+        parser.add_argument('--database', default='default', help='Database alias to query without --parallel')
+        parser.add_argument('--live', action='store_true', help='Compute from the stock tables instead of the StockRollup table')
 
     def handle(self, *args, **options):
+        if options['all']:
+            return self.handle_all(options)
+        if options['category_id'] is None:
+            raise CommandError('Pass a category_id or --all')
+
         category_id = options['category_id']
 
         try:
-            category = Category.objects.get(id=category_id)
+            category = Category.objects.using(options['database']).get(id=category_id)
         except Category.DoesNotExist:
             self.stdout.write(self.style.ERROR(f'Category "{category_id}" does not exist'))
             return
 
-        total_quantity = ProductWarehouse.objects.filter(
-            product__categories=category
-        ).aggregate(total_quantity=Sum('quantity'))['total_quantity'] or 0
+        if options['live']:
+            total_quantity = category_totals(category_ids=[category.pk], using=options['database'])[0]['total_quantity']
+        else:
+            total_quantity = StockRollup.objects.using(options['database']).filter(
+                category=category, warehouse__isnull=True
+            ).values_list('quantity', flat=True).first() or 0
 
         self.stdout.write(self.style.SUCCESS(f'Total quantity of products in the warehouse for category "{category_id}": {total_quantity}'))
+
+    def handle_all(self, options):
+        totals = category_totals if options['live'] else rollup_category_totals
+        if options['parallel']:
+            rows = sharded_category_totals(list(settings.DATABASES), totals=totals, per_warehouse=options['per_warehouse'])
+        else:
+            rows = totals(per_warehouse=options['per_warehouse'], using=options['database'])
+
+        if options['format'] == 'json':
+            self.stdout.write(json.dumps(rows, ensure_ascii=False, indent=2))
+        elif options['format'] == 'csv':
+            fieldnames = list(rows[0]) if rows else ['category_id', 'category', 'total_quantity']
+            writer = csv.DictWriter(self.stdout, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            for row in rows:
+                where = f' in warehouse "{row["warehouse"]}"' if options['per_warehouse'] else ''
+                self.stdout.write(f'{row["category_id"]} {row["category"]}{where}: {row["total_quantity"]}')
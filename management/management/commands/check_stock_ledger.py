@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from management.ledger import check_ledger, rebuild_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Compares the stock ledger balances with ProductWarehouse plus the deferred deliveries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Rebuild the snapshots from ProductWarehouse if they are out of date')
+
+    def handle(self, *args, **options):
+        mismatches = check_ledger()
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('Stock ledger is consistent'))
+            return
+
+        for (product_id, warehouse_id), (balance, expected) in sorted(mismatches.items()):
+            self.stdout.write(f'product={product_id} warehouse={warehouse_id}: ledger {balance}, expected {expected}')
+
+        if options['fix']:
+            rebuild_snapshots()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt stock snapshots, {len(mismatches)} balances were out of date'))
+        else:
+            raise CommandError(f'{len(mismatches)} stock ledger balances are out of date')
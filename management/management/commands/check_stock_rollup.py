@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from management.rollup import check_rollup, rebuild_rollup
+
+
+class Command(BaseCommand):
+    help = 'Compares the StockRollup table with totals computed from ProductWarehouse and Category_Product'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Rebuild the rollup if it is out of date')
+
+    def handle(self, *args, **options):
+        mismatches = check_rollup()
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('Stock rollup is consistent'))
+            return
+
+        for (category_id, warehouse_id), (stored, actual) in sorted(mismatches.items(), key=lambda item: str(item[0])):
+            self.stdout.write(f'category={category_id} warehouse={warehouse_id}: stored {stored}, actual {actual}')
+
+        if options['fix']:
+            rebuild_rollup()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt stock rollup, {len(mismatches)} rows were out of date'))
+        else:
+            raise CommandError(f'{len(mismatches)} stock rollup rows are out of date')
@@ -0,0 +1,55 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from management.bulk import BULK_BATCH_SIZE
+from management.retention import compact_history, ensure_history_partitions, history_models
+
+
+class Command(BaseCommand):
+    help = (
+        'Compacts history older than --days into one record per object and day '
+        '(or per object with --keep object), deleting the rest in batches'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='Keep the full history of the last N days')
+        parser.add_argument(
+            '--keep', choices=['day', 'object'], default='day',
+            help='day: keep the last record of every object per day; object: only the last record before the cutoff',
+        )
+        parser.add_argument('--model', action='append', help='Only compact these historical models, e.g. HistoricalProduct')
+        parser.add_argument('--batch-size', type=int, default=BULK_BATCH_SIZE, help='Objects and deleted rows per batch')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the records that would be deleted')
+        parser.add_argument(
+            '--partitions-ahead', type=int, default=3,
+            help='On Postgres, also create monthly history partitions up to N months ahead',
+        )
+        parser.add_argument('--database', default='default', help='Database alias')
+
+    def handle(self, *args, **options):
+        models = history_models()
+        if options['model']:
+            by_name = {model.__name__: model for model in models}
+            unknown = set(options['model']) - by_name.keys()
+            if unknown:
+                raise CommandError(f'Unknown historical models: {", ".join(sorted(unknown))}')
+            models = [by_name[name] for name in options['model']]
+
+        if not options['dry_run']:
+            for name in ensure_history_partitions(options['partitions_ahead'], options['database']):
+                self.stdout.write(f'Created partition {name}')
+
+        before = timezone.now() - timedelta(days=options['days'])
+        total = 0
+        for model in models:
+            deleted = compact_history(
+                model, before, keep=options['keep'], batch_size=options['batch_size'],
+                dry_run=options['dry_run'], using=options['database'],
+            )
+            total += deleted
+            self.stdout.write(f'{model.__name__}: {deleted} records {"to delete" if options["dry_run"] else "deleted"}')
+
+        verb = 'would be deleted' if options['dry_run'] else 'deleted'
+        self.stdout.write(self.style.SUCCESS(f'{total} history records older than {before:%Y-%m-%d} {verb}'))
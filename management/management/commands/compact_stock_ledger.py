@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from management.stock import compact_ledger
+
+
+class Command(BaseCommand):
+    help = (
+        'Folds the stock movements that are not in StockSnapshot yet into it, one transaction per '
+        'batch, and adds deferred deliveries to the product and warehouse rows'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help='Movements folded per transaction')
+
+    def handle(self, *args, **options):
+        folded = 0
+        while True:
+            count = compact_ledger(options['batch_size'])
+            if not count:
+                break
+            folded += count
+        self.stdout.write(self.style.SUCCESS(f'Folded {folded} stock movements'))
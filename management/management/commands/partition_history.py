@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from management.retention import partition_history
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the history tables on Postgres as tables partitioned by month of history_date '
+        '(or back into plain tables with --undo); compact_history then keeps the partitions coming'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--undo', action='store_true', help='Turn partitioned history tables back into plain ones')
+        parser.add_argument('--months-ahead', type=int, default=3, help='Create monthly partitions up to N months ahead')
+        parser.add_argument('--database', default='default', help='Database alias')
+
+    def handle(self, *args, **options):
+        if connections[options['database']].vendor != 'postgresql':
+            raise CommandError('History tables can only be partitioned on Postgres')
+        tables = partition_history(not options['undo'], options['months_ahead'], options['database'])
+        for table in tables:
+            self.stdout.write(f'Rebuilt {table}')
+        self.stdout.write(self.style.SUCCESS(f'{len(tables)} history tables {"unpartitioned" if options["undo"] else "partitioned"}'))
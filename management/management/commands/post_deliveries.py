@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from management.models import Delivery
+from management.stock import post_deliveries
+
+
+class Command(BaseCommand):
+    help = (
+        'Adds the deliveries that are not posted yet (created with bulk_create or raw SQL, which '
+        'skip the signals) to the stock, one transaction per batch'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Deliveries posted per transaction')
+
+    def handle(self, *args, **options):
+        posted = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                Delivery.objects.filter(posted_at__isnull=True, pk__gt=last_pk).order_by('pk').only('pk')[:options['batch_size']]
+            )
+            if not batch:
+                break
+            posted += post_deliveries(batch)
+            last_pk = batch[-1].pk
+        self.stdout.write(self.style.SUCCESS(f'Posted {posted} deliveries'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from management.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the product full-text search index (Postgres GIN index or SQLite FTS5 table)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Database alias')
+
+    def handle(self, *args, **options):
+        if rebuild_search_index(options['database']):
+            self.stdout.write(self.style.SUCCESS('Product search index rebuilt'))
+        else:
+            self.stdout.write(self.style.WARNING('No full-text index on this database, search uses icontains'))
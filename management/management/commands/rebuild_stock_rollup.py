@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from management.rollup import rebuild_rollup
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the StockRollup table from ProductWarehouse and Category_Product'
+
+    def handle(self, *args, **options):
+        rows = rebuild_rollup()
+        self.stdout.write(self.style.SUCCESS(f'Stock rollup rebuilt: {rows} rows'))
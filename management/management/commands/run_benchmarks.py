@@ -0,0 +1,174 @@
+import io
+import json
+import platform
+import subprocess
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from management.admin import ProductAdmin
+from management.models import Category, Order, Product, Warehouse
+
+from ._private import QueryCounter, benchmark_client
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _export_format(admin_class, extension):
+    formats = admin_class(Product, None).get_export_formats()
+    return next(str(i) for i, file_format in enumerate(formats) if file_format().get_extension() == extension)
+
+
+def scenarios():
+    """(name, callable(client)) pairs; each callable makes one request or one command run."""
+    product = Product.objects.order_by('pk').first()
+    category = Category.objects.order_by('pk').first()
+    warehouse = Warehouse.objects.order_by('pk').first()
+    if product is None or category is None or warehouse is None:
+        raise CommandError('No data to benchmark, run seed_benchmark_data first')
+    as_of = (timezone.now() - timedelta(days=1)).isoformat()
+    csv_format = _export_format(ProductAdmin, 'csv')
+
+    def get(path, **params):
+        return lambda client: client.get(path, params)
+
+    def export(path, file_format):
+        def post(client):
+            response = client.post(path, {'file_format': file_format, 'resource': '0'})
+            for _ in response.streaming_content:
+                pass
+            return response
+        return post
+
+    def category_total_quantity(*args):
+        return lambda client: call_command('category_total_quantity', *args, stdout=io.StringIO())
+
+    return [
+        ('api.products.list', get('/management/api/products/')),
+        ('api.products.list.page_100', get('/management/api/products/', page_size=100)),
+        ('api.products.retrieve', get(f'/management/api/products/{product.pk}/')),
+        ('api.products.search', get('/management/api/products/', search=product.name.split()[0])),
+        ('api.products.filter_products', get('/management/api/products/filter_products/', price='10')),
+        ('api.products.stock_as_of', get('/management/api/products/stock-as-of/', date=as_of, product=product.pk)),
+        ('api.orders.list', get('/management/api/orders/')),
+        ('api.orders.filter_orders', get('/management/api/orders/filter_orders/', quantity='5')),
+        ('api.deliveries.list', get('/management/api/deliveries/')),
+        ('api.categories.list', get('/management/api/categories/')),
+        ('api.categories.stock', get(f'/management/api/categories/{category.pk}/stock/')),
+        ('api.warehouses.stock', get(f'/management/api/warehouses/{warehouse.pk}/stock/')),
+        ('views.index', get('/management/')),
+        ('views.product_list', get('/management/product/')),
+        ('views.product_detail', get(f'/management/product/{product.pk}')),
+        ('views.order_list', get('/management/order/')),
+        ('views.delivery_list', get('/management/delivery/')),
+        ('views.warehouse_detail', get(f'/management/warehouse/{warehouse.pk}/')),
+        ('admin.product.changelist', get('/admin/management/product/')),
+        ('admin.product.search', get('/admin/management/product/', q=product.name.split()[0])),
+        ('admin.order.changelist', get('/admin/management/order/')),
+        ('admin.delivery.changelist', get('/admin/management/delivery/')),
+        ('admin.productwarehouse.changelist', get('/admin/management/productwarehouse/')),
+        ('admin.product.export_csv', export('/admin/management/product/export/', csv_format)),
+        ('command.category_total_quantity', category_total_quantity(str(category.pk))),
+        ('command.category_total_quantity.all', category_total_quantity('--all')),
+        ('command.category_total_quantity.all_live', category_total_quantity('--all', '--live')),
+    ]
+
+
+def run_scenario(client, func, repeat, warmup):
+    for _ in range(warmup):
+        func(client)
+    times, queries, statuses = [], [], set()
+    for _ in range(repeat):
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            start = time.perf_counter()
+            result = func(client)
+            times.append(time.perf_counter() - start)
+        queries.append(counter.count)
+        statuses.add(getattr(result, 'status_code', None))
+    return {
+        'p50_ms': round(_percentile(times, 0.5) * 1000, 3),
+        'p95_ms': round(_percentile(times, 0.95) * 1000, 3),
+        'queries': max(queries),
+        'status': sorted(statuses, key=str),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Times the REST endpoints, template views, admin changelists, exports and category_total_quantity '
+        'through the test client and prints JSON results that can be compared between commits'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per scenario')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed runs per scenario first')
+        parser.add_argument('--only', action='append', help='Only run scenarios whose name starts with this prefix')
+        parser.add_argument('--output', help='Write the results to this file instead of stdout')
+        parser.add_argument('--compare', help='Results file of an earlier run to compare with')
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username='benchmark-runner', defaults={'is_staff': True, 'is_superuser': True})
+        client = benchmark_client()
+        client.force_login(user)
+
+        results = {}
+        for name, func in scenarios():
+            if options['only'] and not any(name.startswith(prefix) for prefix in options['only']):
+                continue
+            results[name] = run_scenario(client, func, options['repeat'], options['warmup'])
+            if options['output']:
+                self.stdout.write(f'{name}: p50 {results[name]["p50_ms"]}ms, {results[name]["queries"]} queries')
+
+        report = {
+            'commit': _git_commit(),
+            'date': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'rows': {model.__name__: model.objects.count() for model in (Product, Order, Category, Warehouse)},
+            'repeat': options['repeat'],
+            'results': results,
+        }
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            self.compare(options['compare'], report)
+
+    def compare(self, path, report):
+        with open(path, encoding='utf-8') as f:
+            previous = json.load(f)
+        self.stdout.write(f'Compared with {previous.get("commit")} ({previous.get("date")}):')
+        for name, result in report['results'].items():
+            before = previous['results'].get(name)
+            if before is None:
+                continue
+            ratio = result['p50_ms'] / before['p50_ms'] if before['p50_ms'] else float('inf')
+            line = (
+                f'{name}: p50 {before["p50_ms"]}ms -> {result["p50_ms"]}ms ({ratio:.2f}x), '
+                f'queries {before["queries"]} -> {result["queries"]}'
+            )
+            style = self.style.ERROR if ratio > 1.2 or result['queries'] > before['queries'] else self.style.SUCCESS
+            self.stdout.write(style(line))
@@ -0,0 +1,127 @@
+import datetime
+import random
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from management.counters import invalidate_dashboard_counts_on_commit
+from management.ledger import rebuild_snapshots
+from management.models import Category, Category_Product, Delivery, Order, Product, ProductWarehouse, Supplier, Warehouse
+from management.rollup import rebuild_rollup
+
+BATCH_SIZE = 5000
+WORDS = [
+    'стол', 'стул', 'шкаф', 'лампа', 'кабель', 'монитор', 'клавиатура', 'мышь', 'принтер', 'бумага',
+    'steel', 'oak', 'compact', 'pro', 'mini', 'max', 'wireless', 'classic', 'office', 'home',
+]
+# Rough shares of order statuses in a live shop.
+STATUS_WEIGHTS = {'PENDING': 10, 'PROCESSING': 10, 'SHIPPED': 20, 'DELIVERED': 50, 'CANCELLED': 10}
+
+
+def _popular(rng, items):
+    """Pick from items with a long tail: a few are chosen often, most rarely."""
+    return items[min(len(items) - 1, int(rng.paretovariate(1.2)) - 1)]
+
+
+def _split(rng, total, parts):
+    """Split total into parts random non-negative integers that add up to it."""
+    cuts = sorted(rng.randint(0, total) for _ in range(parts - 1))
+    return [high - low for low, high in zip([0, *cuts], [*cuts, total])]
+
+
+def seed_data(rng, products=10000, warehouses=10, categories=100, suppliers=200, users=100, orders=50000, deliveries=20000):
+    """
+    Bulk insert a synthetic shop and return the number of rows created per model.
+
+    Every product is stocked in 1-4 warehouses, which split its quantity between them,
+    and sits in 1-3 categories; orders and deliveries favour a small set of popular
+    products. The deliveries are marked posted, since the stock already includes them.
+    bulk_create skips the signals, so the stock rollup and the ledger snapshots are
+    rebuilt at the end.
+    """
+    prefix = f'bench-{uuid.uuid4().hex[:8]}'
+    user_objs = User.objects.bulk_create(User(username=f'{prefix}-user-{i}') for i in range(users))
+    warehouse_objs = Warehouse.objects.bulk_create(
+        Warehouse(name=f'Склад {i}', address=f'ул. Складская, {i}') for i in range(warehouses)
+    )
+    category_objs = Category.objects.bulk_create(
+        Category(name=f'{rng.choice(WORDS).title()} {i}', summary=' '.join(rng.choices(WORDS, k=8))) for i in range(categories)
+    )
+    supplier_objs = Supplier.objects.bulk_create(
+        (Supplier(name=f'ООО Поставщик {i}', contact=f'Контакт {i}', address=f'ул. Заводская, {i}', tel=f'+7 900 {i:07}')
+         for i in range(suppliers)),
+        batch_size=BATCH_SIZE,
+    )
+    product_objs = Product.objects.bulk_create(
+        (Product(
+            name=' '.join(rng.choices(WORDS, k=3)),
+            summary=' '.join(rng.choices(WORDS, k=15)),
+            price=f'{rng.lognormvariate(7, 1) / 100:.2f}',
+            quantity=rng.randint(0, 500),
+        ) for _ in range(products)),
+        batch_size=BATCH_SIZE,
+    )
+    stock = []
+    for product in product_objs:
+        stocked = rng.sample(warehouse_objs, min(rng.randint(1, 4), len(warehouse_objs)))
+        stock.extend(
+            ProductWarehouse(product=product, warehouse=warehouse, quantity=quantity)
+            for warehouse, quantity in zip(stocked, _split(rng, product.quantity, len(stocked)))
+        )
+    ProductWarehouse.objects.bulk_create(stock, batch_size=BATCH_SIZE)
+    Category_Product.objects.bulk_create(
+        (Category_Product(category=category, product=product)
+         for product in product_objs for category in rng.sample(category_objs, min(rng.randint(1, 3), len(category_objs)))),
+        batch_size=BATCH_SIZE,
+    )
+
+    statuses, weights = zip(*STATUS_WEIGHTS.items())
+    Order.objects.bulk_create(
+        (Order(product=_popular(rng, product_objs), user=rng.choice(user_objs), quantity=rng.randint(1, 10),
+               status=rng.choices(statuses, weights)[0])
+         for _ in range(orders)),
+        batch_size=BATCH_SIZE,
+    )
+    now = timezone.now()
+    today = timezone.localdate(now)
+    # Unposted, post_deliveries would add them to the stock a second time.
+    Delivery.objects.bulk_create(
+        (Delivery(product=_popular(rng, product_objs), supplier=_popular(rng, supplier_objs), quantity=rng.randint(10, 500),
+                  date=today - datetime.timedelta(days=rng.randint(0, 730)), posted_at=now)
+         for _ in range(deliveries)),
+        batch_size=BATCH_SIZE,
+    )
+
+    rebuild_rollup()
+    rebuild_snapshots()
+    invalidate_dashboard_counts_on_commit()
+    return {
+        'users': users, 'warehouses': warehouses, 'categories': categories, 'suppliers': suppliers,
+        'products': products, 'orders': orders, 'deliveries': deliveries,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with a synthetic shop for benchmarks, using bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--warehouses', type=int, default=10)
+        parser.add_argument('--categories', type=int, default=100)
+        parser.add_argument('--suppliers', type=int, default=200)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--orders', type=int, default=50000)
+        parser.add_argument('--deliveries', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed gives the same data')
+
+    def handle(self, *args, **options):
+        counts = {name: options[name] for name in ('products', 'warehouses', 'categories', 'suppliers', 'users', 'orders', 'deliveries')}
+        if min(counts['products'], counts['warehouses'], counts['categories'], counts['suppliers'], counts['users']) < 1:
+            raise CommandError('Products, warehouses, categories, suppliers and users need at least one row each')
+
+        with transaction.atomic():
+            created = seed_data(random.Random(options['seed']), **counts)
+        self.stdout.write(self.style.SUCCESS('Created ' + ', '.join(f'{count} {name}' for name, count in created.items())))
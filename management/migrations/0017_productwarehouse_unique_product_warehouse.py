@@ -0,0 +1,35 @@
+# Generated by Django 4.0.10 on 2026-10-18 13:25
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_product_warehouses(apps, schema_editor):
+    # Product.save() wrote the product quantity to every row of a pair, so the copies
+    # hold the same stock; the oldest row is kept.
+    ProductWarehouse = apps.get_model('management', 'ProductWarehouse')
+    db_alias = schema_editor.connection.alias
+    duplicates = (
+        ProductWarehouse.objects.using(db_alias).values('product_id', 'warehouse_id')
+        .annotate(keep=Min('id'), copies=Count('id'))
+        .filter(copies__gt=1)
+    )
+    for row in duplicates:
+        ProductWarehouse.objects.using(db_alias).filter(
+            product_id=row['product_id'], warehouse_id=row['warehouse_id']
+        ).exclude(id=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0016_historicalwarehouse_historicalsupplier_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_product_warehouses, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='productwarehouse',
+            constraint=models.UniqueConstraint(fields=('product', 'warehouse'), name='unique_product_warehouse'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.0.10 on 2026-10-18 13:34
+
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_rollup(apps, schema_editor):
+    ProductWarehouse = apps.get_model('management', 'ProductWarehouse')
+    Category_Product = apps.get_model('management', 'Category_Product')
+    StockRollup = apps.get_model('management', 'StockRollup')
+
+    stock = defaultdict(list)
+    totals = defaultdict(int)
+    for product_id, warehouse_id, quantity in ProductWarehouse.objects.values_list('product_id', 'warehouse_id', 'quantity'):
+        stock[product_id].append((warehouse_id, quantity))
+        totals[None, warehouse_id] += quantity
+    for category_id, product_id in Category_Product.objects.values_list('category_id', 'product_id'):
+        for warehouse_id, quantity in stock[product_id]:
+            totals[category_id, warehouse_id] += quantity
+            totals[category_id, None] += quantity
+
+    StockRollup.objects.bulk_create(
+        (StockRollup(category_id=category_id, warehouse_id=warehouse_id, quantity=quantity)
+         for (category_id, warehouse_id), quantity in totals.items()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0017_productwarehouse_unique_product_warehouse'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.BigIntegerField(default=0)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='management.category')),
+                ('warehouse', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='management.warehouse')),
+            ],
+            options={
+                'verbose_name': 'StockRollup',
+                'verbose_name_plural': 'StockRollups',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='stockrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('category__isnull', False), ('warehouse__isnull', False)), fields=('category', 'warehouse'), name='unique_rollup_category_warehouse'),
+        ),
+        migrations.AddConstraint(
+            model_name='stockrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('warehouse__isnull', True)), fields=('category',), name='unique_rollup_category'),
+        ),
+        migrations.AddConstraint(
+            model_name='stockrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('warehouse',), name='unique_rollup_warehouse'),
+        ),
+        migrations.RunPython(populate_rollup, migrations.RunPython.noop),
+    ]
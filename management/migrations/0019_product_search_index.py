@@ -0,0 +1,67 @@
+from django.db import DatabaseError, migrations, transaction
+
+SEARCH_INDEX_NAME = 'management_product_search'
+SQLITE_FTS_TABLE = 'management_product_fts'
+
+SQLITE_CREATE = [
+    f"CREATE VIRTUAL TABLE {SQLITE_FTS_TABLE} USING fts5(name, summary, content='management_product', content_rowid='id')",
+    f"""CREATE TRIGGER {SQLITE_FTS_TABLE}_ai AFTER INSERT ON management_product BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, name, summary) VALUES (new.id, new.name, new.summary);
+    END""",
+    f"""CREATE TRIGGER {SQLITE_FTS_TABLE}_ad AFTER DELETE ON management_product BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, name, summary) VALUES ('delete', old.id, old.name, old.summary);
+    END""",
+    f"""CREATE TRIGGER {SQLITE_FTS_TABLE}_au AFTER UPDATE OF name, summary ON management_product BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, name, summary) VALUES ('delete', old.id, old.name, old.summary);
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, name, summary) VALUES (new.id, new.name, new.summary);
+    END""",
+    f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')",
+]
+
+SQLITE_DROP = [
+    f'DROP TRIGGER IF EXISTS {SQLITE_FTS_TABLE}_ai',
+    f'DROP TRIGGER IF EXISTS {SQLITE_FTS_TABLE}_ad',
+    f'DROP TRIGGER IF EXISTS {SQLITE_FTS_TABLE}_au',
+    f'DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}',
+]
+
+
+def _gin_index():
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+    return GinIndex(SearchVector('name', 'summary', config='simple'), name=SEARCH_INDEX_NAME)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.add_index(apps.get_model('management', 'Product'), _gin_index())
+    elif vendor == 'sqlite':
+        try:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                schema_editor.execute(SQLITE_CREATE[0])
+        except DatabaseError:
+            # SQLite built without FTS5: product search falls back to icontains.
+            return
+        for sql in SQLITE_CREATE[1:]:
+            schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.remove_index(apps.get_model('management', 'Product'), _gin_index())
+    elif vendor == 'sqlite':
+        for sql in SQLITE_DROP:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0018_stockrollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.0.10 on 2026-10-18 13:38
+
+from django.db import migrations, models
+from django.db.models import Count, F, Min
+
+
+def remove_duplicate_category_products(apps, schema_editor):
+    Category_Product = apps.get_model('management', 'Category_Product')
+    ProductWarehouse = apps.get_model('management', 'ProductWarehouse')
+    StockRollup = apps.get_model('management', 'StockRollup')
+    db_alias = schema_editor.connection.alias
+
+    duplicates = (
+        Category_Product.objects.using(db_alias).values('category_id', 'product_id')
+        .annotate(keep=Min('id'), copies=Count('id'))
+        .filter(copies__gt=1)
+    )
+    for row in duplicates:
+        Category_Product.objects.using(db_alias).filter(
+            category_id=row['category_id'], product_id=row['product_id']
+        ).exclude(id=row['keep']).delete()
+        # Every extra copy had counted the product's stock into the category once more.
+        extra = row['copies'] - 1
+        for warehouse_id, quantity in ProductWarehouse.objects.using(db_alias).filter(product_id=row['product_id']).values_list('warehouse_id', 'quantity'):
+            for key in (warehouse_id, None):
+                StockRollup.objects.using(db_alias).filter(category_id=row['category_id'], warehouse_id=key).update(
+                    quantity=F('quantity') - extra * quantity
+                )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0019_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='delivery',
+            index=models.Index(fields=['date'], name='delivery_date'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'date'], name='order_status_date'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['date'], name='order_date'),
+        ),
+        migrations.AddIndex(
+            model_name='productwarehouse',
+            index=models.Index(fields=['warehouse', 'product'], name='productwarehouse_wh_product'),
+        ),
+        migrations.RunPython(remove_duplicate_category_products, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='category_product',
+            constraint=models.UniqueConstraint(fields=('category', 'product'), name='unique_category_product'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+INDEX = models.Index(fields=['id', 'history_date'], name='hist_productwarehouse_id_date')
+
+
+# simple_history builds the historical model's Meta itself, so the index lives outside the
+# model state: it only serves stock_as_of() looking up the latest record per row.
+def add_index(apps, schema_editor):
+    schema_editor.add_index(apps.get_model('management', 'HistoricalProductWarehouse'), INDEX)
+
+
+def remove_index(apps, schema_editor):
+    schema_editor.remove_index(apps.get_model('management', 'HistoricalProductWarehouse'), INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0020_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_index, remove_index),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.0.10 on 2026-10-18 13:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+def mark_existing_posted(apps, schema_editor):
+    # Their stock was entered by hand before deliveries were posted, adding it again would count it twice.
+    Delivery = apps.get_model('management', 'Delivery')
+    Delivery.objects.using(schema_editor.connection.alias).update(posted_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0022_historicalproductwarehouse_id_date_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='delivery',
+            name='idempotency_key',
+            field=models.CharField(editable=False, max_length=100, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='delivery',
+            name='posted_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='delivery',
+            name='warehouse',
+            field=models.ForeignKey(blank=True, help_text='Склад, на который поступил товар', null=True, on_delete=django.db.models.deletion.SET_NULL, to='management.warehouse'),
+        ),
+        migrations.AddField(
+            model_name='historicaldelivery',
+            name='idempotency_key',
+            field=models.CharField(db_index=True, editable=False, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='historicaldelivery',
+            name='posted_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='historicaldelivery',
+            name='warehouse',
+            field=models.ForeignKey(blank=True, db_constraint=False, help_text='Склад, на который поступил товар', null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='management.warehouse'),
+        ),
+        migrations.RunPython(mark_existing_posted, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.0.10 on 2026-10-18 14:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def snapshot_current_stock(apps, schema_editor):
+    ProductWarehouse = apps.get_model('management', 'ProductWarehouse')
+    StockSnapshot = apps.get_model('management', 'StockSnapshot')
+    db_alias = schema_editor.connection.alias
+    StockSnapshot.objects.using(db_alias).bulk_create(
+        (StockSnapshot(product_id=product_id, warehouse_id=warehouse_id, quantity=quantity)
+         for product_id, warehouse_id, quantity in
+         ProductWarehouse.objects.using(db_alias).values_list('product_id', 'warehouse_id', 'quantity').iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0023_delivery_posting'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='management.product')),
+                ('warehouse', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='management.warehouse')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('kind', models.CharField(choices=[('DELIVERY', 'Delivery'), ('ORDER', 'Order'), ('TRANSFER', 'Transfer'), ('ADJUSTMENT', 'Adjustment')], max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('deferred', models.BooleanField(default=False)),
+                ('folded_at', models.DateTimeField(blank=True, null=True)),
+                ('product', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='management.product')),
+                ('warehouse', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='management.warehouse')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='stocksnapshot',
+            constraint=models.UniqueConstraint(fields=('product', 'warehouse'), name='unique_stocksnapshot'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(condition=models.Q(('folded_at__isnull', True)), fields=['product', 'warehouse'], name='stockmovement_unfolded'),
+        ),
+        migrations.RunPython(snapshot_current_stock, migrations.RunPython.noop),
+    ]
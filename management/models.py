@@ -1,14 +1,17 @@
-from django.db import models
+from django.db import models, transaction
 from django.urls import reverse
 from django.contrib.auth.models import User
-from simple_history.models import HistoricalRecords
+from simple_history.utils import bulk_create_with_history
+
+from .history import DeferredHistoricalRecords
+from .signals import stock_changed
 
 
 class Category(models.Model):
     name = models.CharField(max_length=200, help_text="Введите название категории товара")
     summary = models.TextField(max_length=1000, help_text="Введите краткое описание категории")
 
-    history = HistoricalRecords()
+    history = DeferredHistoricalRecords()
     def get_absolute_url(self):
         return reverse('category-detail', args=[str(self.id)])
 
@@ -23,19 +26,22 @@ class Category(models.Model):
 class Category_Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     product = models.ForeignKey("Product", on_delete=models.CASCADE)
-    history = HistoricalRecords()
+    history = DeferredHistoricalRecords()
     def __str__(self):
         return f"{self.category} - {self.product}"
 
     class Meta:
         verbose_name = 'Category_Product'
         verbose_name_plural = 'Categories_Products'
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'product'], name='unique_category_product'),
+        ]
 
 
 class Warehouse(models.Model):
     name = models.CharField(max_length=200, help_text="Введите название склада")
     address = models.CharField(max_length=200, help_text="Введите адрес склада")
-    history = HistoricalRecords()
+    history = DeferredHistoricalRecords()
     def get_absolute_url(self):
         return reverse('warehouse-detail', args=[str(self.id)])
 
@@ -43,17 +49,105 @@ class Warehouse(models.Model):
         return self.name
 
 
+class ProductWarehouseManager(models.Manager):
+    def sync_product(self, product, warehouses):
+        """
+        Link product to warehouses in a constant number of queries.
+
+        Rows for warehouses that are not linked yet are created with their history in
+        bulk. Existing rows are left alone: their quantities are kept per warehouse by
+        deliveries, orders and transfers. A product's first row starts with
+        product.quantity, so the stock it was entered with is in a warehouse; the rows
+        linked after it start empty.
+        """
+        return self.sync_products([product], {product.pk: warehouses})
+
+    def sync_products(self, products, warehouses):
+        """
+        Same as sync_product for many products at once.
+
+        warehouses maps product pk to the warehouses that must be linked.
+        """
+        products = {product.pk: product for product in products}
+        linked = set(self.filter(product__in=products).values_list('product_id', 'warehouse_id'))
+        stocked = {product_id for product_id, _ in linked}
+
+        missing = []
+        for pk, product_warehouses in warehouses.items():
+            for warehouse in product_warehouses:
+                if (pk, warehouse.pk) not in linked:
+                    linked.add((pk, warehouse.pk))
+                    quantity = 0 if pk in stocked else products[pk].quantity
+                    stocked.add(pk)
+                    missing.append(self.model(product=products[pk], warehouse=warehouse, quantity=quantity))
+
+        deltas = {(row.product_id, row.warehouse_id): row.quantity for row in missing if row.quantity}
+        with transaction.atomic():
+            if missing:
+                bulk_create_with_history(missing, self.model)
+            if deltas:
+                # The product's stock, placed in its first warehouse.
+                stock_changed.send(sender=self.model, deltas=deltas, kind='ADJUSTMENT')
+        return len(missing)
+
+
 class ProductWarehouse(models.Model):
     product = models.ForeignKey("Product", on_delete=models.CASCADE)
     warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(help_text="Введите количество товара на складе", default=0)
-    history = HistoricalRecords()
+    history = DeferredHistoricalRecords()
+
+    objects = ProductWarehouseManager()
+
     def __str__(self):
         return f"{self.product} - {self.warehouse}"
 
     class Meta:
         verbose_name = 'ProductWarehouse'
         verbose_name_plural = 'ProductWarehouses'
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'warehouse'], name='unique_product_warehouse'),
+        ]
+        indexes = [
+            # filter_products and the warehouse stock views look rows up by warehouse first.
+            models.Index(fields=['warehouse', 'product'], name='productwarehouse_wh_product'),
+        ]
+
+
+class StockRollup(models.Model):
+    """
+    Stock totals kept up to date from stock_changed and Category_Product signals.
+
+    (category, warehouse) rows hold the stock of a category in one warehouse,
+    (category, NULL) rows the category total and (NULL, warehouse) rows the warehouse total.
+    """
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True)
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, null=True, blank=True)
+    quantity = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.category or '*'} - {self.warehouse or '*'}: {self.quantity}"
+
+    class Meta:
+        verbose_name = 'StockRollup'
+        verbose_name_plural = 'StockRollups'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['category', 'warehouse'],
+                condition=models.Q(category__isnull=False, warehouse__isnull=False),
+                name='unique_rollup_category_warehouse',
+            ),
+            models.UniqueConstraint(
+                fields=['category'],
+                condition=models.Q(warehouse__isnull=True),
+                name='unique_rollup_category',
+            ),
+            models.UniqueConstraint(
+                fields=['warehouse'],
+                condition=models.Q(category__isnull=True),
+                name='unique_rollup_warehouse',
+            ),
+        ]
 
 
 class Product(models.Model):
@@ -63,23 +157,13 @@ class Product(models.Model):
     quantity = models.PositiveIntegerField(help_text="Введите количество товара")
     warehouses = models.ManyToManyField(Warehouse, through=ProductWarehouse, related_name='products', help_text="Склады", blank=True)
     categories = models.ManyToManyField(Category, through=Category_Product, related_name='products', help_text="Категории", blank=True)
-    history = HistoricalRecords()
+    history = DeferredHistoricalRecords()
     def get_absolute_url(self):
         return reverse('product-detail', args=[str(self.id)])
 
     def __str__(self):
         return self.name
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        warehouses = self.warehouses.all()
-        for warehouse in warehouses:
-            ProductWarehouse.objects.update_or_create(
-                product=self,
-                warehouse=warehouse,
-                defaults={'quantity': self.quantity}
-            )
-
 
 class Order(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -94,7 +178,7 @@ class Order(models.Model):
         ('CANCELLED', 'Cancelled'),
     )
     status = models.CharField(max_length=100, choices=STATUS_CHOICES)
-    history = HistoricalRecords()
+    history = DeferredHistoricalRecords()
 
     def get_absolute_url(self):
         return reverse('order-detail', args=[str(self.id)])
@@ -102,23 +186,112 @@ class Order(models.Model):
     def __str__(self):
         return str(self.product)
 
+    class Meta:
+        indexes = [
+            # The admin status and date filters, alone or together.
+            models.Index(fields=['status', 'date'], name='order_status_date'),
+            models.Index(fields=['date'], name='order_date'),
+        ]
+
 
 class Delivery(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     supplier = models.ForeignKey("Supplier", on_delete=models.CASCADE)
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.SET_NULL, null=True, blank=True, help_text="Склад, на который поступил товар")
     quantity = models.PositiveIntegerField(help_text="Введите количество поставляемого товара")
     date = models.DateField(help_text="Выберите дату поставки")
-    history = HistoricalRecords()
+    # Set once the quantity has been added to the stock, see stock.post_deliveries.
+    posted_at = models.DateTimeField(null=True, editable=False)
+    idempotency_key = models.CharField(max_length=100, null=True, unique=True, editable=False)
+    history = DeferredHistoricalRecords()
+
+    # Posting adds the quantity of the product to the warehouse once; changing them
+    # afterwards would leave the stock, the ledger and the rollup disagreeing with the row.
+    POSTED_FIELDS = ('product', 'warehouse', 'quantity')
 
     def get_absolute_url(self):
         return reverse('delivery-detail', args=[str(self.id)])
 
+    def posted_changes(self, values):
+        """Names of the POSTED_FIELDS that values ({name: value or object}) would change on a posted delivery."""
+        if self.posted_at is None:
+            return []
+        changed = []
+        for name in self.POSTED_FIELDS:
+            if name not in values:
+                continue
+            field = self._meta.get_field(name)
+            value = values[name]
+            if field.is_relation and isinstance(value, models.Model):
+                value = value.pk
+            if value != getattr(self, field.attname):
+                changed.append(name)
+        return changed
+
     def __str__(self):
         return str(self.product)
 
     class Meta:
         verbose_name = 'Delivery'
         verbose_name_plural = 'Deliveries'
+        indexes = [
+            # The admin date filter.
+            models.Index(fields=['date'], name='delivery_date'),
+        ]
+
+
+class StockMovement(models.Model):
+    """
+    Append-only ledger of warehouse stock changes. Rows are only inserted; compaction
+    (stock.compact_ledger) sets folded_at once a row is added to its StockSnapshot.
+    Deferred rows are deliveries that are not in ProductWarehouse yet, compaction adds them.
+
+    ProductWarehouse stays the stock that is sold from: reserve_stock locks its rows and
+    decrements them only while they cover the order, which the ledger cannot do without
+    locking the same rows. The ledger records who changed the stock and why, gives
+    balances that check_stock_ledger compares against it, and with
+    MANAGEMENT_DEFER_DELIVERY_STOCK lets deliveries skip the hot rows.
+    """
+    KIND_CHOICES = (
+        ('DELIVERY', 'Delivery'),
+        ('ORDER', 'Order'),
+        ('TRANSFER', 'Transfer'),
+        ('ADJUSTMENT', 'Adjustment'),
+    )
+    # No database constraints: like the history tables, the ledger outlives deleted
+    # products and warehouses, whose removal it records as the last movement.
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    quantity = models.IntegerField()
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+    deferred = models.BooleanField(default=False)
+    folded_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.product} - {self.warehouse}: {self.quantity:+}"
+
+    class Meta:
+        indexes = [
+            # The balance query sums the movements that are not folded yet.
+            models.Index(fields=['product', 'warehouse'], condition=models.Q(folded_at__isnull=True), name='stockmovement_unfolded'),
+        ]
+
+
+class StockSnapshot(models.Model):
+    """Sum of the folded StockMovement rows of one product in one warehouse."""
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    quantity = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.product} - {self.warehouse}: {self.quantity}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'warehouse'], name='unique_stocksnapshot'),
+        ]
 
 
 class Supplier(models.Model):
@@ -126,7 +299,7 @@ class Supplier(models.Model):
     contact = models.CharField(max_length=200, help_text="Введите контактное лицо")
     address = models.CharField(max_length=200, help_text="Введите адрес поставщика")
     tel = models.CharField(max_length=20, help_text="Введите номер телефона")
-    history = HistoricalRecords()
+    history = DeferredHistoricalRecords()
 
     def get_absolute_url(self):
         return reverse('supplier-detail', args=[str(self.id)])
@@ -1,5 +1,61 @@
+from collections import OrderedDict
+
+from django.db import connections
 from rest_framework import pagination
+from rest_framework.response import Response
+
+from .search import SEARCH_RANK
+
+
+class KeysetPagination(pagination.CursorPagination):
+  """
+  Cursor pagination on the primary key: every page is an indexed range scan, so
+  deep pages cost the same as the first one. No COUNT(*) is run unless the client
+  asks for it with ?count=exact, or ?count=approx for a planner estimate on Postgres.
+  """
+  page_size = 20
+  page_size_query_param = 'page_size'
+  max_page_size = 1000
+  ordering = 'pk'
+  count_query_param = 'count'
+
+  def get_ordering(self, request, queryset, view):
+    # A ranked search pages by relevance; the cursor keeps the rank and offsets within ties.
+    if SEARCH_RANK in queryset.query.annotations:
+      return (f'-{SEARCH_RANK}', 'pk')
+    return super().get_ordering(request, queryset, view)
+
+  def paginate_queryset(self, queryset, request, view=None):
+    self.count = None
+    mode = request.query_params.get(self.count_query_param)
+    if mode == 'exact':
+      self.count = queryset.count()
+    elif mode == 'approx':
+      self.count = self.estimate_count(queryset)
+    return super().paginate_queryset(queryset, request, view)
+
+  def estimate_count(self, queryset):
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+      return queryset.count()
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+      cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+      plan = cursor.fetchone()[0]
+    return int(plan[0]['Plan']['Plan Rows'])
+
+  def get_paginated_response(self, data):
+    response = OrderedDict([('next', self.get_next_link()), ('previous', self.get_previous_link())])
+    if self.count is not None:
+      response['count'] = self.count
+    response['results'] = data
+    return Response(response)
+
+  def get_paginated_response_schema(self, schema):
+    schema = super().get_paginated_response_schema(schema)
+    schema['properties']['count'] = {'type': 'integer', 'example': 123}
+    return schema
 
 
-class ProductsPagination(pagination.PageNumberPagination):
+class ProductsPagination(KeysetPagination):
   page_size = 5
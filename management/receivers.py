@@ -0,0 +1,98 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from . import ledger, rollup, search
+from .caching import CACHED_MODELS, bump_generation_on_commit
+from .counters import COUNTED_MODELS, invalidate_dashboard_counts_on_commit
+from .models import ProductWarehouse, Category_Product, Delivery
+from .signals import post_bulk_save, stock_changed
+from .stock import post_deliveries
+
+
+@receiver(post_save)
+@receiver(post_bulk_save)
+def dashboard_counts_on_save(sender, created=False, **kwargs):
+    if created and sender in COUNTED_MODELS.values():
+        invalidate_dashboard_counts_on_commit()
+
+
+@receiver(post_delete)
+def dashboard_counts_on_delete(sender, **kwargs):
+    if sender in COUNTED_MODELS.values():
+        invalidate_dashboard_counts_on_commit()
+
+
+@receiver(post_save)
+@receiver(post_bulk_save)
+@receiver(post_delete)
+def response_cache_generation(sender, **kwargs):
+    if sender in CACHED_MODELS:
+        bump_generation_on_commit(sender)
+
+
+@receiver(post_save, sender=Delivery)
+def post_created_delivery(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        post_deliveries([instance])
+
+
+@receiver(post_bulk_save, sender=Delivery)
+def post_created_deliveries(sender, instances, created, **kwargs):
+    if created:
+        post_deliveries(instances)
+
+
+@receiver(stock_changed)
+def rollup_on_stock_changed(sender, deltas, **kwargs):
+    rollup.apply_stock_deltas(deltas)
+
+
+@receiver(stock_changed)
+def ledger_on_stock_changed(sender, deltas, kind, **kwargs):
+    if kind is not None:
+        ledger.record_movements(deltas, kind)
+
+
+@receiver(pre_save, sender=ProductWarehouse)
+@receiver(pre_save, sender=Category_Product)
+def remember_previous_row(sender, instance, **kwargs):
+    instance._previous_row = None
+    if instance.pk is not None:
+        instance._previous_row = sender.objects.filter(pk=instance.pk).first()
+
+
+@receiver(post_save, sender=ProductWarehouse)
+def rollup_on_product_warehouse_save(sender, instance, **kwargs):
+    deltas = {(instance.product_id, instance.warehouse_id): instance.quantity}
+    previous = getattr(instance, '_previous_row', None)
+    if previous is not None:
+        key = (previous.product_id, previous.warehouse_id)
+        deltas[key] = deltas.get(key, 0) - previous.quantity
+    rollup.apply_stock_deltas(deltas)
+    ledger.record_movements(deltas, 'ADJUSTMENT')
+
+
+@receiver(post_delete, sender=ProductWarehouse)
+def rollup_on_product_warehouse_delete(sender, instance, **kwargs):
+    deltas = {(instance.product_id, instance.warehouse_id): -instance.quantity}
+    rollup.apply_stock_deltas(deltas)
+    ledger.record_movements(deltas, 'ADJUSTMENT')
+
+
+@receiver(post_save, sender=Category_Product)
+def rollup_on_category_product_save(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_row', None)
+    if previous is not None:
+        rollup.apply_membership_change(previous.category_id, previous.product_id, -1)
+    rollup.apply_membership_change(instance.category_id, instance.product_id, 1)
+
+
+@receiver(post_delete, sender=Category_Product)
+def rollup_on_category_product_delete(sender, instance, **kwargs):
+    rollup.apply_membership_change(instance.category_id, instance.product_id, -1)
+
+
+@receiver(connection_created)
+def sqlite_fts_on_connect(sender, connection, **kwargs):
+    search.forget_sqlite_fts_available(connection)
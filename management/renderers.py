@@ -0,0 +1,66 @@
+import json
+
+from django.db.models import prefetch_related_objects
+from django.http import StreamingHttpResponse
+from rest_framework import renderers
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+STREAM_CHUNK_SIZE = 1000
+
+
+def _dumps(item):
+    return json.dumps(item, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+class NDJSONRenderer(renderers.BaseRenderer):
+    """Newline-delimited JSON. Streamed responses bypass it; it renders errors and plain lists."""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        items = data if isinstance(data, list) else [data]
+        return ''.join(_dumps(item) for item in items).encode(self.charset)
+
+
+# For actions that offer ?format=ndjson next to the usual renderers.
+NDJSON_RENDERER_CLASSES = list(api_settings.DEFAULT_RENDERER_CLASSES) + [NDJSONRenderer]
+
+
+def iter_ndjson(queryset, get_serializer, chunk_size=STREAM_CHUNK_SIZE, representation=None):
+    """
+    Serialize queryset one chunk at a time, walking it in primary key order.
+
+    Chunks are fetched by keyset (pk > last seen) rather than with .iterator(),
+    so many-to-many fields can be prefetched per chunk instead of per row.
+    With a FastRepresentation the chunks are read as .values() rows instead.
+    """
+    many_to_many = [field.name for field in queryset.model._meta.many_to_many]
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        if representation is not None:
+            rows = list(representation.values(chunk)[:chunk_size])
+            if not rows:
+                return
+            for item in representation.to_representation(rows):
+                yield _dumps(item)
+            last_pk = rows[-1][representation.pk_column]
+            continue
+
+        objs = list(chunk[:chunk_size])
+        if not objs:
+            return
+        prefetch_related_objects(objs, *many_to_many)
+        for item in get_serializer(objs, many=True).data:
+            yield _dumps(item)
+        last_pk = objs[-1].pk
+
+
+def ndjson_response(queryset, get_serializer, representation=None):
+    return StreamingHttpResponse(
+        iter_ndjson(queryset, get_serializer, representation=representation),
+        content_type=NDJSONRenderer.media_type,
+    )
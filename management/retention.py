@@ -0,0 +1,207 @@
+from datetime import date, timedelta
+
+from django.apps import apps
+from django.db import DatabaseError, connections, transaction
+from django.utils import timezone
+
+from .bulk import BULK_BATCH_SIZE
+
+
+def history_models():
+    return [model for model in apps.get_app_config('management').get_models() if hasattr(model, 'instance_type')]
+
+
+def _redundant_history_ids(rows, keep):
+    """
+    rows are (history_id, id, history_date, history_type) ordered by id and history_date.
+
+    keep='day' keeps the last record of every object per day, keep='object' only the last
+    record of every object, and nothing at all for objects whose last record is a deletion.
+    """
+    previous = None
+    for history_id, pk, history_date, history_type in rows:
+        key = (pk, timezone.localdate(history_date)) if keep == 'day' else pk
+        if previous is not None:
+            if previous[1] == key:
+                yield previous[0]
+            elif keep == 'object' and previous[2] == '-':
+                yield previous[0]
+        previous = (history_id, key, history_type)
+    if previous is not None and keep == 'object' and previous[2] == '-':
+        yield previous[0]
+
+
+def compact_history(history_model, before, keep='day', batch_size=BULK_BATCH_SIZE, dry_run=False, using='default'):
+    """
+    Delete the history of history_model older than before that is not needed to know the
+    state of every object at the end of each day (keep='day') or at before (keep='object').
+
+    Objects are processed batch_size at a time and every batch is deleted in its own
+    transaction, so the tables are never locked for long. Returns the number of records
+    that were (or with dry_run would be) deleted.
+    """
+    old = history_model.objects.using(using).filter(history_date__lt=before)
+    deleted = 0
+    last_id = None
+    while True:
+        objects = old if last_id is None else old.filter(id__gt=last_id)
+        ids = list(objects.order_by('id').values_list('id', flat=True).distinct()[:batch_size])
+        if not ids:
+            return deleted
+        last_id = ids[-1]
+
+        rows = old.filter(id__in=ids).order_by('id', 'history_date', 'history_id').values_list(
+            'history_id', 'id', 'history_date', 'history_type',
+        )
+        doomed = list(_redundant_history_ids(rows, keep))
+        deleted += len(doomed)
+        if dry_run:
+            continue
+        for start in range(0, len(doomed), batch_size):
+            with transaction.atomic(using=using):
+                history_model.objects.using(using).filter(history_id__in=doomed[start:start + batch_size]).delete()
+
+
+def _month_start(day):
+    return day.replace(day=1)
+
+
+def _next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def partitioned_history_tables(using='default'):
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return []
+    tables = [model._meta.db_table for model in history_models()]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid '
+            'WHERE c.relname = ANY(%s)',
+            [tables],
+        )
+        return sorted(row[0] for row in cursor.fetchall())
+
+
+def ensure_history_partitions(months_ahead=3, using='default'):
+    """
+    Create the monthly partitions of the partitioned history tables (see partition_history)
+    up to months_ahead months from now. Returns the names of the partitions created.
+
+    A month whose rows already landed in the default partition is skipped: Postgres
+    refuses to create a partition that overlaps rows of the default one.
+    """
+    connection = connections[using]
+    created = []
+    start = _month_start(date.today())
+    months = [start]
+    for _ in range(months_ahead):
+        months.append(_next_month(months[-1]))
+
+    with connection.cursor() as cursor:
+        for table in partitioned_history_tables(using):
+            for month in months:
+                name = f'{table}_p{month:%Y%m}'
+                cursor.execute('SELECT to_regclass(%s)', [name])
+                if cursor.fetchone()[0] is not None:
+                    continue
+                try:
+                    with transaction.atomic(using=using):
+                        cursor.execute(
+                            f'CREATE TABLE {connection.ops.quote_name(name)} PARTITION OF {connection.ops.quote_name(table)} '
+                            f'FOR VALUES FROM (%s) TO (%s)',
+                            [month, _next_month(month)],
+                        )
+                except DatabaseError:
+                    continue
+                created.append(name)
+    return created
+
+
+def _rebuild_table(cursor, quote, table, partitioned, months_ahead):
+    """
+    Recreate table as a range partitioned table on history_date (or back as a plain one),
+    copying the rows, indexes, foreign keys and the history_id sequence over.
+    """
+    old = f'{table}_old'
+    cursor.execute(
+        'SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint '
+        "WHERE conrelid = %s::regclass AND contype IN ('p', 'f')",
+        [table],
+    )
+    constraints = cursor.fetchall()
+    primary_key = next(name for name, kind, _ in constraints if kind == 'p')
+    foreign_keys = [(name, definition) for name, kind, definition in constraints if kind == 'f']
+    cursor.execute(
+        'SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s AND indexname != %s',
+        [table, primary_key],
+    )
+    indexes = cursor.fetchall()
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'history_id')", [table])
+    sequence = cursor.fetchone()[0]
+
+    # Index and constraint names are kept, so they have to be freed on the old table first.
+    for name, _ in indexes:
+        cursor.execute(f'DROP INDEX {quote(name)}')
+    for name, _, _ in constraints:
+        cursor.execute(f'ALTER TABLE {quote(table)} DROP CONSTRAINT {quote(name)}')
+    cursor.execute(f'ALTER TABLE {quote(table)} RENAME TO {quote(old)}')
+
+    if partitioned:
+        cursor.execute(
+            f'CREATE TABLE {quote(table)} (LIKE {quote(old)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            f'PARTITION BY RANGE (history_date)'
+        )
+        # A primary key of a partitioned table has to include the partition key.
+        cursor.execute(f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(primary_key)} PRIMARY KEY (history_id, history_date)')
+        cursor.execute(f'SELECT min(history_date) FROM {quote(old)}')
+        first = cursor.fetchone()[0]
+        month = (first.date() if first else date.today()).replace(day=1)
+        last = date.today().replace(day=1)
+        for _ in range(months_ahead):
+            last = _next_month(last)
+        while month <= last:
+            cursor.execute(
+                f'CREATE TABLE {quote(f"{table}_p{month:%Y%m}")} PARTITION OF {quote(table)} FOR VALUES FROM (%s) TO (%s)',
+                [month, _next_month(month)],
+            )
+            month = _next_month(month)
+        cursor.execute(f'CREATE TABLE {quote(f"{table}_default")} PARTITION OF {quote(table)} DEFAULT')
+    else:
+        cursor.execute(f'CREATE TABLE {quote(table)} (LIKE {quote(old)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        cursor.execute(f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(primary_key)} PRIMARY KEY (history_id)')
+
+    if sequence:
+        cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {quote(table)}.history_id')
+    cursor.execute(f'INSERT INTO {quote(table)} SELECT * FROM {quote(old)}')
+    cursor.execute(f'DROP TABLE {quote(old)}')
+
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} {definition}')
+    for _, definition in indexes:
+        cursor.execute(definition.replace(' ON ONLY ', ' ON '))
+
+
+def partition_history(partitioned=True, months_ahead=3, using='default'):
+    """
+    Turn the history tables on Postgres into tables partitioned by month of history_date,
+    with partitions up to months_ahead months from now and a default one, or back into
+    plain tables with partitioned=False. Every table is rebuilt in its own transaction,
+    which copies all of its rows, so run it in a maintenance window. Returns the tables
+    that were rebuilt; tables already in the requested shape are left alone.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return []
+    done = set(partitioned_history_tables(using))
+    rebuilt = []
+    with connection.cursor() as cursor:
+        for model in history_models():
+            table = model._meta.db_table
+            if (table in done) == partitioned:
+                continue
+            with transaction.atomic(using=using):
+                _rebuild_table(cursor, connection.ops.quote_name, table, partitioned, months_ahead)
+            rebuilt.append(table)
+    return rebuilt
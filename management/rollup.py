@@ -0,0 +1,117 @@
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+
+from .inventory import category_totals
+from .models import Category, Category_Product, ProductWarehouse, StockRollup
+
+
+def _apply(changes):
+    # Always in the same order, so two transactions updating the same rollup rows (a
+    # transfer each way between two warehouses) wait for each other instead of deadlocking.
+    for (category_id, warehouse_id), delta in sorted(changes.items(), key=lambda item: (item[0][0] or 0, item[0][1] or 0)):
+        if not delta:
+            continue
+        rows = StockRollup.objects.filter(category_id=category_id, warehouse_id=warehouse_id)
+        if rows.update(quantity=F('quantity') + delta):
+            continue
+        try:
+            with transaction.atomic():
+                StockRollup.objects.create(category_id=category_id, warehouse_id=warehouse_id, quantity=delta)
+        except IntegrityError:
+            # Created concurrently by another writer between the update and the insert.
+            rows.update(quantity=F('quantity') + delta)
+
+
+def apply_stock_deltas(deltas):
+    """Fold {(product_id, warehouse_id): delta} into the rollup."""
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    categories = defaultdict(list)
+    memberships = Category_Product.objects.filter(product_id__in={product_id for product_id, _ in deltas})
+    for product_id, category_id in memberships.values_list('product_id', 'category_id'):
+        categories[product_id].append(category_id)
+
+    changes = defaultdict(int)
+    for (product_id, warehouse_id), delta in deltas.items():
+        changes[None, warehouse_id] += delta
+        for category_id in categories[product_id]:
+            changes[category_id, warehouse_id] += delta
+            changes[category_id, None] += delta
+    _apply(changes)
+
+
+def apply_membership_change(category_id, product_id, sign):
+    """Add (sign=1) or remove (sign=-1) the stock of a product to a category."""
+    changes = defaultdict(int)
+    for warehouse_id, quantity in ProductWarehouse.objects.filter(product_id=product_id).values_list('warehouse_id', 'quantity'):
+        changes[category_id, warehouse_id] += sign * quantity
+        changes[category_id, None] += sign * quantity
+    _apply(changes)
+
+
+def _live_rollup():
+    totals = {}
+    for row in category_totals(per_warehouse=True):
+        totals[row['category_id'], row['warehouse_id']] = row['total_quantity']
+    for row in category_totals():
+        totals[row['category_id'], None] = row['total_quantity']
+    warehouses = ProductWarehouse.objects.values('warehouse_id').annotate(total=Sum('quantity')).order_by()
+    for row in warehouses:
+        totals[None, row['warehouse_id']] = row['total']
+    return totals
+
+
+def rebuild_rollup():
+    """Recompute the whole rollup from ProductWarehouse and Category_Product."""
+    with transaction.atomic():
+        StockRollup.objects.all().delete()
+        rows = StockRollup.objects.bulk_create(
+            (StockRollup(category_id=category_id, warehouse_id=warehouse_id, quantity=quantity)
+             for (category_id, warehouse_id), quantity in _live_rollup().items()),
+            batch_size=1000,
+        )
+    return len(rows)
+
+
+def check_rollup():
+    """Return {(category_id, warehouse_id): (stored, actual)} for every row that is out of date."""
+    actual = _live_rollup()
+    stored = {
+        (category_id, warehouse_id): quantity
+        for category_id, warehouse_id, quantity in StockRollup.objects.values_list('category_id', 'warehouse_id', 'quantity')
+    }
+    return {
+        key: (stored.get(key, 0), actual.get(key, 0))
+        for key in stored.keys() | actual.keys()
+        if stored.get(key, 0) != actual.get(key, 0)
+    }
+
+
+def rollup_category_totals(per_warehouse=False, category_ids=None, using='default'):
+    """Same rows as inventory.category_totals, read from the rollup instead of the stock tables."""
+    if per_warehouse:
+        rows = StockRollup.objects.using(using).filter(category__isnull=False, warehouse__isnull=False)
+        if category_ids is not None:
+            rows = rows.filter(category_id__in=category_ids)
+        return [
+            {'category_id': category_id, 'category': category, 'warehouse_id': warehouse_id,
+             'warehouse': warehouse, 'total_quantity': quantity}
+            for category_id, category, warehouse_id, warehouse, quantity in rows.order_by('category_id', 'warehouse_id').values_list(
+                'category_id', 'category__name', 'warehouse_id', 'warehouse__name', 'quantity',
+            )
+        ]
+
+    categories = Category.objects.using(using).order_by('pk')
+    totals = StockRollup.objects.using(using).filter(category__isnull=False, warehouse__isnull=True)
+    if category_ids is not None:
+        categories = categories.filter(pk__in=category_ids)
+        totals = totals.filter(category_id__in=category_ids)
+    totals = dict(totals.values_list('category_id', 'quantity'))
+    return [
+        {'category_id': pk, 'category': name, 'total_quantity': totals.get(pk, 0)}
+        for pk, name in categories.values_list('pk', 'name')
+    ]
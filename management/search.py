@@ -0,0 +1,111 @@
+import re
+
+from django.db import connections
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+
+SEARCH_CONFIG = 'simple'
+SEARCH_INDEX_NAME = 'management_product_search'
+SQLITE_FTS_TABLE = 'management_product_fts'
+SEARCH_RANK = 'search_rank'
+
+
+def product_search_vector():
+    # Imported lazily: django.contrib.postgres needs psycopg2, which only Postgres deployments have.
+    from django.contrib.postgres.search import SearchVector
+    return SearchVector('name', 'summary', config=SEARCH_CONFIG)
+
+
+def _tokens(terms):
+    return re.findall(r'\w+', terms)
+
+
+def sqlite_fts_available(using='default'):
+    """
+    Whether the FTS5 table exists. Checked once per database connection rather than on
+    every search; the receiver of connection_created forgets the answer.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    if getattr(connection, '_product_fts_available', None) is None:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [SQLITE_FTS_TABLE])
+            connection._product_fts_available = cursor.fetchone() is not None
+    return connection._product_fts_available
+
+
+def forget_sqlite_fts_available(connection):
+    connection._product_fts_available = None
+
+
+def search_products(queryset, terms):
+    """
+    Filter products whose name or summary contain words starting with every term and
+    annotate search_rank, higher for better matches.
+
+    Uses the GIN-indexed tsvector and ts_rank on Postgres and the FTS5 table and bm25()
+    on SQLite; other backends fall back to icontains with a constant rank. Ordering is
+    left to the caller, see ranked().
+    """
+    tokens = _tokens(terms)
+    if not tokens:
+        return queryset
+    connection = connections[queryset.db]
+
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+        query = SearchQuery(' & '.join(f'{token}:*' for token in tokens), config=SEARCH_CONFIG, search_type='raw')
+        return queryset.alias(search_vector=product_search_vector()).filter(search_vector=query).annotate(
+            **{SEARCH_RANK: SearchRank(F('search_vector'), query)},
+        )
+
+    if connection.vendor == 'sqlite' and sqlite_fts_available(queryset.db):
+        match = ' '.join('"{}"*'.format(token.replace('"', '""')) for token in tokens)
+        table = connection.ops.quote_name(SQLITE_FTS_TABLE)
+        product_id = f'{connection.ops.quote_name(queryset.model._meta.db_table)}.{connection.ops.quote_name("id")}'
+        return queryset.filter(
+            pk__in=RawSQL(f'SELECT rowid FROM {table} WHERE {table} MATCH %s', [match]),
+        ).annotate(**{
+            # bm25() is lower for better matches; negated so it sorts like ts_rank.
+            SEARCH_RANK: RawSQL(
+                f'SELECT -bm25({table}) FROM {table} WHERE {table} MATCH %s AND rowid = {product_id}', [match],
+                output_field=FloatField(),
+            ),
+        })
+
+    condition = Q()
+    for token in tokens:
+        condition &= Q(name__icontains=token) | Q(summary__icontains=token)
+    return queryset.filter(condition).annotate(**{SEARCH_RANK: Value(0.0, output_field=FloatField())})
+
+
+def ranked(queryset):
+    """Best matches of search_products first; the pk keeps equal ranks in a stable order."""
+    if SEARCH_RANK not in queryset.query.annotations:
+        return queryset
+    return queryset.order_by(f'-{SEARCH_RANK}', 'pk')
+
+
+def rebuild_search_index(using='default'):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'REINDEX INDEX {connection.ops.quote_name(SEARCH_INDEX_NAME)}')
+            return True
+        if sqlite_fts_available(using):
+            table = connection.ops.quote_name(SQLITE_FTS_TABLE)
+            cursor.execute(f"INSERT INTO {table}({table}) VALUES ('rebuild')")
+            return True
+    return False
+
+
+class ProductSearchFilter(SearchFilter):
+    """SearchFilter backed by search_products instead of icontains lookups."""
+
+    def filter_queryset(self, request, queryset, view):
+        terms = request.query_params.get(self.search_param, '')
+        if not terms.strip():
+            return queryset
+        return ranked(search_products(queryset, terms))
@@ -1,4 +1,9 @@
+import datetime
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from rest_framework import serializers
+from .bulk import BulkListSerializer
 from .models import Category, Category_Product, Warehouse, ProductWarehouse, Product, Order, Delivery, Supplier
 
 
@@ -6,18 +11,21 @@ class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = '__all__'
+        list_serializer_class = BulkListSerializer
 
 
 class WarehouseSerializer(serializers.ModelSerializer):
     class Meta:
         model = Warehouse
         fields = '__all__'
+        list_serializer_class = BulkListSerializer
 
 
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = '__all__'
+        list_serializer_class = BulkListSerializer
 
     def validate_quantity(self, value):
         if value < 0:
@@ -28,6 +36,7 @@ class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = '__all__'
+        list_serializer_class = BulkListSerializer
 
     def validate_quantity(self, value):
         if value < 0:
@@ -35,18 +44,105 @@ class OrderSerializer(serializers.ModelSerializer):
         return value
 
 
+class PlaceOrderSerializer(OrderSerializer):
+    warehouse = serializers.PrimaryKeyRelatedField(
+        queryset=Warehouse.objects.all(), required=False, allow_null=True, write_only=True,
+    )
+
+    def create(self, validated_data):
+        # Only says where to reserve the stock, Order has no warehouse.
+        validated_data.pop('warehouse', None)
+        return super().create(validated_data)
+
+
+POSTED_FIELD_ERROR = 'Cannot be changed once the delivery is posted to the stock.'
+
+
+def _posted_errors(delivery, attrs):
+    return {name: [POSTED_FIELD_ERROR] for name in delivery.posted_changes(attrs)}
+
+
+class DeliveryListSerializer(BulkListSerializer):
+    def validate(self, attrs):
+        if self.instance is not None:
+            errors = [_posted_errors(delivery, item) for delivery, item in zip(self.instance, attrs)]
+            if any(errors):
+                raise serializers.ValidationError(errors)
+        return attrs
+
+
 class DeliverySerializer(serializers.ModelSerializer):
     class Meta:
         model = Delivery
         fields = '__all__'
+        list_serializer_class = DeliveryListSerializer
 
     def validate_quantity(self, value):
         if value < 0:
             raise serializers.ValidationError("Quantity should be a non-negative integer.")
         return value
 
+    def validate(self, attrs):
+        # Under many=True the child is handed the whole list; DeliveryListSerializer checks it.
+        if isinstance(self.instance, Delivery):
+            errors = _posted_errors(self.instance, attrs)
+            if errors:
+                raise serializers.ValidationError(errors)
+        return attrs
+
 
 class SupplierSerializer(serializers.ModelSerializer):
     class Meta:
         model = Supplier
         fields = '__all__'
+        list_serializer_class = BulkListSerializer
+
+
+class StockAsOfSerializer(serializers.Serializer):
+    date = serializers.CharField()
+    product = serializers.ListField(child=serializers.IntegerField(), required=False)
+    warehouse = serializers.ListField(child=serializers.IntegerField(), required=False)
+
+    def validate_date(self, value):
+        try:
+            day = parse_date(value)
+        except ValueError:
+            day = None
+        if day is None:
+            return serializers.DateTimeField().run_validation(value)
+        # A bare date means the stock at the end of that day.
+        return timezone.make_aware(datetime.datetime.combine(day, datetime.time.max))
+
+
+class TransferLineSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    source = serializers.IntegerField()
+    destination = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+    def validate(self, attrs):
+        if attrs['source'] == attrs['destination']:
+            raise serializers.ValidationError("Source and destination should be different warehouses.")
+        return attrs
+
+
+class TransferSerializer(serializers.Serializer):
+    lines = TransferLineSerializer(many=True, allow_empty=False)
+
+    def validate_lines(self, lines):
+        # One query per model for the whole batch instead of a lookup per line.
+        products = set(Product.objects.filter(pk__in={line['product'] for line in lines}).values_list('pk', flat=True))
+        warehouse_ids = {line['source'] for line in lines} | {line['destination'] for line in lines}
+        warehouses = set(Warehouse.objects.filter(pk__in=warehouse_ids).values_list('pk', flat=True))
+        errors = []
+        for line in lines:
+            line_errors = {}
+            if line['product'] not in products:
+                line_errors['product'] = ['Not found.']
+            for name in ('source', 'destination'):
+                if line[name] not in warehouses:
+                    line_errors[name] = ['Not found.']
+            errors.append(line_errors)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return lines
@@ -0,0 +1,11 @@
+from django.dispatch import Signal
+
+# Sent by BulkListSerializer after bulk_create/bulk_update, which skip post_save.
+# Arguments: sender (model class), instances, created.
+post_bulk_save = Signal()
+
+# Sent whenever ProductWarehouse quantities change, including set-based writes
+# that bypass post_save. Arguments: sender, deltas ({(product_id, warehouse_id): delta})
+# and kind, the StockMovement kind the ledger records them as, or None when the ledger
+# already has them.
+stock_changed = Signal()
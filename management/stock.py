@@ -0,0 +1,293 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Case, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from simple_history.utils import bulk_create_with_history
+
+from . import ledger
+from .models import Delivery, Product, ProductWarehouse
+from .signals import stock_changed
+
+
+class InsufficientStock(Exception):
+    pass
+
+
+def _write_history(model, pks, update=True):
+    rows = list(model.objects.filter(pk__in=pks))
+    model.history.bulk_history_create(rows, update=update)
+
+
+def defer_delivery_stock():
+    return getattr(settings, 'MANAGEMENT_DEFER_DELIVERY_STOCK', False)
+
+
+def _increment_quantities(model, deltas):
+    """Add {pk: amount} to model.quantity in one UPDATE of F('quantity') + CASE."""
+    if deltas:
+        amount = Case(*[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()], default=Value(0))
+        model.objects.filter(pk__in=deltas).update(quantity=F('quantity') + amount)
+
+
+def reserve_stock(product, quantity, warehouse=None):
+    """
+    Take quantity units of product off its warehouse rows, lowest pk first, and off
+    product.quantity.
+
+    The rows are locked with SELECT ... FOR UPDATE in pk order, so concurrent buyers of
+    the same product queue for the stock instead of skipping rows another buyer holds.
+    Every decrement is also a conditional UPDATE (quantity >= taken), so backends without
+    row locks can never drive a row below zero either. Must be called inside
+    transaction.atomic(): on InsufficientStock the caller rolls back what was taken.
+    """
+    rows = ProductWarehouse.objects.filter(product=product, quantity__gt=0).order_by('pk')
+    if warehouse is not None:
+        rows = rows.filter(warehouse=warehouse)
+    if connection.features.has_select_for_update:
+        rows = rows.select_for_update()
+
+    remaining = quantity
+    taken = {}
+    deltas = {}
+    for pk, warehouse_id, available in rows.values_list('pk', 'warehouse_id', 'quantity'):
+        while available:
+            take = min(available, remaining)
+            updated = ProductWarehouse.objects.filter(pk=pk, quantity__gte=take).update(quantity=F('quantity') - take)
+            if updated:
+                taken[pk] = take
+                deltas[product.pk, warehouse_id] = -take
+                remaining -= take
+                break
+            # Without row locks somebody may have taken stock from this row since it was read.
+            available = ProductWarehouse.objects.filter(pk=pk).values_list('quantity', flat=True).first() or 0
+        if not remaining:
+            break
+
+    if remaining:
+        raise InsufficientStock(f'Not enough stock of "{product}": requested {quantity}, available {quantity - remaining}')
+
+    # Greatest() keeps rows written before Product.quantity was the warehouse total from going negative.
+    Product.objects.filter(pk=product.pk).update(quantity=Greatest(F('quantity') - quantity, Value(0)))
+    _write_history(Product, [product.pk])
+    _write_history(ProductWarehouse, taken)
+    stock_changed.send(sender=ProductWarehouse, deltas=deltas, kind='ORDER')
+    return taken
+
+
+def add_stock(product_deltas, deltas, kind):
+    """
+    Add {product_id: amount} to Product.quantity and {(product_id, warehouse_id): amount}
+    to the warehouse rows, creating the rows that are missing, with one F() increment per
+    table. kind is passed on to stock_changed for the ledger. Must be called inside
+    transaction.atomic().
+    """
+    existing = {
+        (product_id, warehouse_id): pk
+        for pk, product_id, warehouse_id in ProductWarehouse.objects.filter(
+            product_id__in={product_id for product_id, _ in deltas},
+            warehouse_id__in={warehouse_id for _, warehouse_id in deltas},
+        ).values_list('pk', 'product_id', 'warehouse_id')
+        if (product_id, warehouse_id) in deltas
+    }
+    _increment_quantities(Product, product_deltas)
+    _increment_quantities(ProductWarehouse, {pk: deltas[key] for key, pk in existing.items()})
+    missing = [
+        ProductWarehouse(product_id=product_id, warehouse_id=warehouse_id, quantity=quantity)
+        for (product_id, warehouse_id), quantity in deltas.items() if (product_id, warehouse_id) not in existing
+    ]
+    if missing:
+        bulk_create_with_history(missing, ProductWarehouse)
+
+    _write_history(Product, product_deltas)
+    _write_history(ProductWarehouse, existing.values())
+    if deltas:
+        stock_changed.send(sender=ProductWarehouse, deltas=dict(deltas), kind=kind)
+
+
+def post_deliveries(deliveries):
+    """
+    Add the quantity of every delivery that is not posted yet to its product and to a
+    warehouse row, and mark it posted. Returns the number of deliveries posted.
+
+    The deliveries are claimed by setting posted_at on the rows where it is still NULL,
+    so a delivery that is posted twice (a retry, the command racing the signal) adds its
+    quantity once. Stock goes up with one F() increment per table and never through a
+    read-modify-save, so concurrent postings and reservations do not overwrite each other.
+    The stock goes to the delivery's warehouse, or to the product's first warehouse row
+    when it has none.
+
+    With MANAGEMENT_DEFER_DELIVERY_STOCK the deliveries are only appended to the stock
+    ledger, without touching the product and warehouse rows that concurrent deliveries of
+    the same product would wait on; compact_ledger adds them to the stock later.
+    """
+    pks = [delivery.pk for delivery in deliveries]
+    with transaction.atomic():
+        pending = Delivery.objects.filter(pk__in=pks, posted_at__isnull=True)
+        if connection.features.has_select_for_update:
+            pending = pending.select_for_update()
+        rows = list(pending.values_list('pk', 'product_id', 'warehouse_id', 'quantity'))
+        if not rows:
+            return 0
+        posted_at = timezone.now()
+        Delivery.objects.filter(pk__in=[pk for pk, _, _, _ in rows]).update(posted_at=posted_at)
+
+        unplaced = {product_id for _, product_id, warehouse_id, _ in rows if warehouse_id is None}
+        first_warehouse = {}
+        if unplaced:
+            warehouse_rows = ProductWarehouse.objects.filter(product_id__in=unplaced).order_by('pk')
+            for product_id, warehouse_id in warehouse_rows.values_list('product_id', 'warehouse_id'):
+                first_warehouse.setdefault(product_id, warehouse_id)
+
+        defer = defer_delivery_stock()
+        product_deltas = defaultdict(int)
+        deltas = defaultdict(int)
+        for _, product_id, warehouse_id, quantity in rows:
+            warehouse_id = warehouse_id or first_warehouse.get(product_id)
+            if warehouse_id is not None:
+                deltas[product_id, warehouse_id] += quantity
+            # A deferred delivery reaches the product at compaction, unless it is not
+            # stocked anywhere and so has no ledger row to wait in.
+            if not defer or warehouse_id is None:
+                product_deltas[product_id] += quantity
+
+        if defer:
+            ledger.record_movements(deltas, 'DELIVERY', deferred=True)
+            deltas = {}
+        add_stock(product_deltas, deltas, 'DELIVERY')
+        _write_history(Delivery, [pk for pk, _, _, _ in rows])
+
+    claimed = {pk for pk, _, _, _ in rows}
+    for delivery in deliveries:
+        if delivery.pk in claimed:
+            delivery.posted_at = posted_at
+    return len(rows)
+
+
+def compact_ledger(batch_size=10000):
+    """
+    Fold up to batch_size stock movements into StockSnapshot, oldest first, and return
+    how many were folded. Deferred deliveries among them are added to the product and
+    warehouse rows in the same transaction.
+    """
+    with transaction.atomic():
+        rows = ledger.claim_unfolded(batch_size)
+        snapshot_deltas = defaultdict(int)
+        product_deltas = defaultdict(int)
+        deferred_deltas = defaultdict(int)
+        for product_id, warehouse_id, quantity, deferred in rows:
+            snapshot_deltas[product_id, warehouse_id] += quantity
+            if deferred:
+                product_deltas[product_id] += quantity
+                deferred_deltas[product_id, warehouse_id] += quantity
+        ledger.fold_into_snapshots(snapshot_deltas)
+        if deferred_deltas:
+            # kind=None: the ledger already has these movements.
+            add_stock(product_deltas, deferred_deltas, None)
+    return len(rows)
+
+
+def transfer_stock(lines):
+    """
+    Move stock between warehouses: lines is an iterable of
+    (product_id, source_id, destination_id, quantity). All lines are applied in one
+    transaction or, with InsufficientStock, none of them.
+
+    Lines are netted per warehouse row first, so opposing lines cancel out. Destination
+    rows that do not exist are created, then exactly the rows involved are locked in
+    primary key order, so concurrent transfers over the same rows wait for each other
+    instead of deadlocking. Decrements are one conditional UPDATE (quantity >= taken) and
+    increments one F() UPDATE; history, creation records included, is written in bulk.
+    Returns the {(product_id, warehouse_id): delta} that was applied.
+    """
+    deltas = defaultdict(int)
+    for product_id, source_id, destination_id, quantity in lines:
+        deltas[product_id, source_id] -= quantity
+        deltas[product_id, destination_id] += quantity
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return {}
+
+    warehouses = defaultdict(set)
+    for product_id, warehouse_id in deltas:
+        warehouses[product_id].add(warehouse_id)
+    # Exactly the rows of the transfer, not every warehouse of every product in it.
+    pairs = Q()
+    for product_id, warehouse_ids in warehouses.items():
+        pairs |= Q(product_id=product_id, warehouse_id__in=warehouse_ids)
+
+    with transaction.atomic():
+        rows = ProductWarehouse.objects.filter(pairs)
+        existing = set(rows.values_list('product_id', 'warehouse_id'))
+        missing = sorted(key for key, delta in deltas.items() if delta > 0 and key not in existing)
+        if missing:
+            # Sorted and conflict-tolerant, so two transfers creating the same rows do not collide.
+            ProductWarehouse.objects.bulk_create(
+                [ProductWarehouse(product_id=product_id, warehouse_id=warehouse_id, quantity=0) for product_id, warehouse_id in missing],
+                ignore_conflicts=True,
+            )
+        if connection.features.has_select_for_update:
+            rows = rows.select_for_update()
+        locked = {
+            (product_id, warehouse_id): (pk, quantity)
+            for pk, product_id, warehouse_id, quantity in rows.order_by('pk').values_list('pk', 'product_id', 'warehouse_id', 'quantity')
+        }
+        if missing:
+            # Creation history for the rows this transfer inserted. A row a concurrent
+            # transfer inserted first is only locked here once that one has committed,
+            # with its own creation record.
+            created = [locked[key][0] for key in missing]
+            recorded = set(ProductWarehouse.history.filter(id__in=created).values_list('id', flat=True))
+            _write_history(ProductWarehouse, [pk for pk in created if pk not in recorded], update=False)
+
+        short = [
+            f'product {product_id} in warehouse {warehouse_id}: requested {-delta}, available {locked.get((product_id, warehouse_id), (None, 0))[1]}'
+            for (product_id, warehouse_id), delta in sorted(deltas.items())
+            if delta < 0 and locked.get((product_id, warehouse_id), (None, 0))[1] < -delta
+        ]
+        if short:
+            raise InsufficientStock('Not enough stock to transfer: ' + '; '.join(short))
+
+        taken = {locked[key][0]: -delta for key, delta in deltas.items() if delta < 0}
+        amount = Case(*[When(pk=pk, then=Value(take)) for pk, take in taken.items()], default=Value(0))
+        updated = ProductWarehouse.objects.filter(pk__in=taken, quantity__gte=amount).update(quantity=F('quantity') - amount)
+        if updated != len(taken):
+            # Only possible without row locks, when another writer took stock since it was read.
+            raise InsufficientStock('Not enough stock to transfer: stock changed during the transfer')
+        _increment_quantities(ProductWarehouse, {locked[key][0]: delta for key, delta in deltas.items() if delta > 0})
+
+        _write_history(ProductWarehouse, [pk for pk, _ in locked.values()])
+        stock_changed.send(sender=ProductWarehouse, deltas=deltas, kind='TRANSFER')
+    return deltas
+
+
+def stock_as_of(when, product_ids=None, warehouse_ids=None, using='default'):
+    """
+    Return {(product_id, warehouse_id): quantity} as it was at the datetime when,
+    read from the ProductWarehouse history.
+
+    Takes the latest history record of every warehouse row at or before when (DISTINCT ON
+    where the backend has it, that is Postgres, a correlated subquery elsewhere, both
+    served by the (id, history_date) index) and leaves out rows that were deleted by then.
+    """
+    history = ProductWarehouse.history.model.objects.using(using)
+    records = history.filter(history_date__lte=when)
+    if product_ids is not None:
+        records = records.filter(product_id__in=product_ids)
+    if warehouse_ids is not None:
+        records = records.filter(warehouse_id__in=warehouse_ids)
+
+    if connections[using].features.can_distinct_on_fields:
+        latest = records.order_by('id', '-history_date', '-history_id').distinct('id')
+    else:
+        latest = records.filter(history_id=Subquery(
+            history.filter(id=OuterRef('id'), history_date__lte=when).order_by('-history_date', '-history_id').values('history_id')[:1]
+        ))
+    rows = latest.values_list('product_id', 'warehouse_id', 'quantity', 'history_type')
+    return {
+        (product_id, warehouse_id): quantity
+        for product_id, warehouse_id, quantity, history_type in rows
+        if history_type != '-'
+    }
@@ -0,0 +1,1111 @@
+import csv
+import datetime
+import io
+import json
+import random
+import re
+import threading
+import time
+import unittest
+import warnings
+from unittest import mock
+
+from django.contrib.admin import site
+from django.contrib.auth.models import User
+from django.db.models import QuerySet, Sum
+from django.core.cache import cache
+from django.core.paginator import UnorderedObjectListWarning
+from django.db import DatabaseError, OperationalError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from import_export.forms import ExportForm
+from rest_framework.test import APIClient
+from rest_framework.utils.encoders import JSONEncoder
+
+from .admin import ProductResource
+from .caching import get_generation
+from .counters import get_dashboard_counts
+from .fast import FastRepresentation
+from .history import deferred_history
+from .imports import bulk_import
+from .instrumentation import route_stats
+from .ledger import check_ledger, stock_balances
+from .management.commands.seed_benchmark_data import seed_data
+from .renderers import iter_ndjson
+from .retention import _redundant_history_ids, compact_history
+from .search import ranked, search_products
+from .serializers import ProductSerializer
+from .views import DeliveryViewSet
+from .models import Category, Category_Product, Delivery, Order, Product, ProductWarehouse, Supplier, Warehouse
+from .rollup import apply_stock_deltas, check_rollup
+from .stock import InsufficientStock, compact_ledger, post_deliveries, reserve_stock, stock_as_of, transfer_stock
+
+
+def create_stock(quantities, name='Стол'):
+    """A product stocked with {warehouse: quantity}; product.quantity is their sum."""
+    product = Product.objects.create(name=name, summary=name, price=10, quantity=sum(quantities.values()))
+    for warehouse, quantity in quantities.items():
+        ProductWarehouse.objects.create(product=product, warehouse=warehouse, quantity=quantity)
+    return product
+
+
+def run_in_threads(count, func):
+    """Run func(index) in count threads started together, each with its own connection."""
+    barrier = threading.Barrier(count)
+    errors = []
+
+    def target(index):
+        try:
+            barrier.wait()
+            func(index)
+        except Exception as e:  # noqa: BLE001 - reported by the test below
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def retry_locked(func, rng, attempts=200):
+    """
+    Call func, retrying while the database refuses a concurrent writer. SQLite has no
+    row locks and fails such writes at once instead of waiting; a row-locking backend
+    only gets here on a deadlock, which is a bug, so those are re-raised.
+    """
+    for attempt in range(attempts):
+        try:
+            return func()
+        except OperationalError as e:
+            if 'deadlock' in str(e) or attempt == attempts - 1:
+                raise
+            time.sleep(rng.uniform(0, 0.001 * 2 ** min(attempt, 6)))
+
+
+class StockTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.w1 = Warehouse.objects.create(name='Склад 1', address='ул. Складская, 1')
+        cls.w2 = Warehouse.objects.create(name='Склад 2', address='ул. Складская, 2')
+        cls.supplier = Supplier.objects.create(name='ООО Поставщик', contact='Иван', address='ул. Заводская, 1', tel='+7 900 0000000')
+
+    def stock(self, product):
+        return dict(ProductWarehouse.objects.filter(product=product).values_list('warehouse_id', 'quantity'))
+
+
+class SyncProductQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouses = [Warehouse.objects.create(name=f'Склад {i}', address=f'ул. Складская, {i}') for i in range(20)]
+        # Creates the rollup rows of every warehouse, so linking only ever updates them.
+        for warehouse in cls.warehouses:
+            create_stock({warehouse: 1}, name='Полка')
+
+    def new_product(self, name):
+        return Product.objects.create(name=name, summary=name, price=10, quantity=5)
+
+    def test_linking_takes_the_same_queries_for_any_number_of_warehouses(self):
+        # Read the links, insert the rows and their history, then rollup and ledger, in a savepoint.
+        product = self.new_product('Стол')
+        with self.assertNumQueries(8):
+            ProductWarehouse.objects.sync_product(product, self.warehouses[:2])
+        products = [self.new_product(f'Стул {i}') for i in range(5)]
+        with self.assertNumQueries(8):
+            ProductWarehouse.objects.sync_products(products, {product.pk: self.warehouses for product in products})
+        self.assertEqual(ProductWarehouse.objects.filter(product__in=products).count(), 100)
+
+    def test_linking_again_only_reads_the_links(self):
+        product = self.new_product('Стол')
+        ProductWarehouse.objects.sync_product(product, self.warehouses)
+        with self.assertNumQueries(3):
+            self.assertEqual(ProductWarehouse.objects.sync_product(product, self.warehouses), 0)
+
+    def test_product_save_does_not_touch_warehouse_rows(self):
+        product = self.new_product('Стол')
+        ProductWarehouse.objects.sync_product(product, self.warehouses)
+        product.name = 'Стол дубовый'
+        with self.assertNumQueries(2):
+            product.save()
+
+
+class DeliveryPostingTests(StockTestCase):
+    def test_product_save_keeps_posted_warehouse_stock(self):
+        product = create_stock({self.w1: 6, self.w2: 4})
+        Delivery.objects.create(product=product, supplier=self.supplier, warehouse=self.w2, quantity=5, date=datetime.date.today())
+        self.assertEqual(self.stock(product), {self.w1.pk: 6, self.w2.pk: 9})
+
+        product.refresh_from_db()
+        self.assertEqual(product.quantity, 15)
+        product.name = 'Стол дубовый'
+        product.save()
+        self.assertEqual(self.stock(product), {self.w1.pk: 6, self.w2.pk: 9})
+
+
+
+class DeliveryApiTests(StockTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = create_stock({self.w1: 10})
+
+    def deliver(self, key=None, quantity=5):
+        data = {'product': self.product.pk, 'supplier': self.supplier.pk, 'warehouse': self.w1.pk, 'quantity': quantity, 'date': datetime.date.today()}
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        return self.client.post('/api/deliveries/', data, format='json', **headers)
+
+    def test_retry_with_the_same_key_posts_once(self):
+        first = self.deliver(key='delivery-1')
+        self.assertEqual(first.status_code, 201, first.data)
+        retry = self.deliver(key='delivery-1')
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.data['id'], first.data['id'])
+        self.assertEqual(Delivery.objects.count(), 1)
+        self.assertEqual(self.stock(self.product), {self.w1.pk: 15})
+
+    def test_concurrent_request_with_the_same_key_gets_the_first_delivery(self):
+        first = self.deliver(key='delivery-1')
+        replay = DeliveryViewSet._replay
+        calls = []
+
+        def not_committed_yet(view, keys, many):
+            # The first lookup misses, as if the other request had not committed yet;
+            # the insert then hits the unique key and the delivery is looked up again.
+            calls.append(keys)
+            return None if len(calls) == 1 else replay(view, keys, many)
+
+        with mock.patch.object(DeliveryViewSet, '_replay', not_committed_yet):
+            second = self.deliver(key='delivery-1')
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data['id'], first.data['id'])
+        self.assertEqual(self.stock(self.product), {self.w1.pk: 15})
+
+    def test_posted_stock_fields_are_read_only(self):
+        delivery = self.deliver().data
+        url = f'/api/deliveries/{delivery["id"]}/'
+        for change in ({'quantity': 50}, {'warehouse': self.w2.pk}, {'product': create_stock({}, name='Стул').pk}):
+            response = self.client.patch(url, change, format='json')
+            self.assertEqual(response.status_code, 400, change)
+            self.assertEqual(list(response.data), list(change))
+        response = self.client.patch('/api/deliveries/bulk/', [{'id': delivery['id'], 'quantity': 50}], format='json')
+        self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(self.client.patch(url, {'date': '2026-01-01', 'quantity': 5}, format='json').status_code, 200)
+        self.assertEqual(self.client.put(url, {**delivery, 'date': '2026-01-02'}, format='json').status_code, 200)
+        self.assertEqual(Delivery.objects.get(pk=delivery['id']).quantity, 5)
+        self.assertEqual(self.stock(self.product), {self.w1.pk: 15})
+
+    def test_update_view_keeps_posted_stock_fields(self):
+        delivery = Delivery.objects.get(pk=self.deliver().data['id'])
+        response = self.client.post(f'/delivery/{delivery.pk}/update/', {
+            'product': self.product.pk, 'supplier': self.supplier.pk, 'warehouse': self.w2.pk, 'quantity': 50, 'date': '2026-01-01',
+        })
+        self.assertEqual(response.status_code, 302)
+        delivery.refresh_from_db()
+        self.assertEqual((delivery.warehouse_id, delivery.quantity, delivery.date), (self.w1.pk, 5, datetime.date(2026, 1, 1)))
+
+
+class ReserveStockTests(StockTestCase):
+    def test_reservation_takes_from_warehouse_and_product(self):
+        product = create_stock({self.w1: 10, self.w2: 5})
+        with transaction.atomic():
+            reserve_stock(product, 3, warehouse=self.w1)
+        product.refresh_from_db()
+        self.assertEqual(product.quantity, 12)
+        self.assertEqual(self.stock(product), {self.w1.pk: 7, self.w2.pk: 5})
+
+        product.name = 'Стол дубовый'
+        product.save()
+        self.assertEqual(self.stock(product), {self.w1.pk: 7, self.w2.pk: 5})
+
+    def test_reservation_spans_warehouses_and_reports_available_stock(self):
+        product = create_stock({self.w1: 2, self.w2: 5})
+        with transaction.atomic():
+            reserve_stock(product, 4)
+        self.assertEqual(self.stock(product), {self.w1.pk: 0, self.w2.pk: 3})
+
+        with self.assertRaisesMessage(InsufficientStock, 'requested 4, available 3'):
+            with transaction.atomic():
+                reserve_stock(product, 4)
+        self.assertEqual(self.stock(product), {self.w1.pk: 0, self.w2.pk: 3})
+
+
+
+class TransferStockTests(StockTestCase):
+    def test_transfer_creates_the_destination_row_with_history(self):
+        product = create_stock({self.w1: 10})
+        transfer_stock([(product.pk, self.w1.pk, self.w2.pk, 4)])
+        self.assertEqual(self.stock(product), {self.w1.pk: 6, self.w2.pk: 4})
+        created = ProductWarehouse.objects.get(product=product, warehouse=self.w2)
+        self.assertEqual(
+            list(created.history.order_by('history_id').values_list('history_type', 'quantity')), [('+', 0), ('~', 4)],
+        )
+
+        product.refresh_from_db()
+        self.assertEqual(product.quantity, 10)
+        product.name = 'Стол дубовый'
+        product.save()
+        self.assertEqual(self.stock(product), {self.w1.pk: 6, self.w2.pk: 4})
+
+    def test_only_the_rows_of_the_transfer_are_locked(self):
+        w3 = Warehouse.objects.create(name='Склад 3', address='ул. Складская, 3')
+        table = create_stock({self.w1: 5, self.w2: 5, w3: 5})
+        chair = create_stock({self.w1: 5, self.w2: 5, w3: 5}, name='Стул')
+        with CaptureQueriesContext(connection) as queries:
+            transfer_stock([(table.pk, self.w1.pk, self.w2.pk, 1), (chair.pk, w3.pk, self.w1.pk, 1)])
+        # Run the locking read again to see which rows it covers.
+        lock = next(query['sql'] for query in queries if 'ORDER BY' in query['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute(lock)
+            rows = {(product_id, warehouse_id) for _, product_id, warehouse_id, _ in cursor.fetchall()}
+        self.assertEqual(rows, {(table.pk, self.w1.pk), (table.pk, self.w2.pk), (chair.pk, w3.pk), (chair.pk, self.w1.pk)})
+
+
+
+class LedgerBalanceTests(StockTestCase):
+    def assertLedgerMatchesStock(self, product, expected):
+        self.assertEqual(self.stock(product), expected)
+        self.assertEqual(check_ledger(), {})
+        balances = stock_balances(product_ids=[product.pk])
+        # A row that never held stock has no movements, so no balance either.
+        self.assertEqual({warehouse_id: balances.get((product.pk, warehouse_id), 0) for warehouse_id in expected}, expected)
+
+    def deliver(self, product, warehouse, quantity):
+        Delivery.objects.create(product=product, supplier=self.supplier, warehouse=warehouse, quantity=quantity, date=datetime.date.today())
+
+    def test_balance_follows_deliveries_orders_transfers_and_compaction(self):
+        product = create_stock({self.w1: 10})
+        ProductWarehouse.objects.sync_product(product, [self.w2])
+        self.assertLedgerMatchesStock(product, {self.w1.pk: 10, self.w2.pk: 0})
+
+        self.deliver(product, self.w2, 5)
+        self.assertLedgerMatchesStock(product, {self.w1.pk: 10, self.w2.pk: 5})
+        with transaction.atomic():
+            reserve_stock(product, 12)
+        self.assertLedgerMatchesStock(product, {self.w1.pk: 0, self.w2.pk: 3})
+        transfer_stock([(product.pk, self.w2.pk, self.w1.pk, 2)])
+        self.assertLedgerMatchesStock(product, {self.w1.pk: 2, self.w2.pk: 1})
+
+        self.assertGreater(compact_ledger(), 0)
+        self.assertLedgerMatchesStock(product, {self.w1.pk: 2, self.w2.pk: 1})
+
+    @override_settings(MANAGEMENT_DEFER_DELIVERY_STOCK=True)
+    def test_deferred_delivery_reaches_the_stock_on_compaction(self):
+        product = create_stock({self.w1: 10})
+        self.deliver(product, self.w1, 5)
+        self.assertEqual(self.stock(product), {self.w1.pk: 10})
+        self.assertEqual(check_ledger(), {})
+        self.assertEqual(stock_balances(product_ids=[product.pk]), {(product.pk, self.w1.pk): 15})
+        # Orders take stock off the warehouse rows, so a deferred delivery cannot be sold yet.
+        with self.assertRaises(InsufficientStock), transaction.atomic():
+            reserve_stock(product, 12)
+
+        compact_ledger()
+        self.assertLedgerMatchesStock(product, {self.w1.pk: 15})
+        product.refresh_from_db()
+        self.assertEqual(product.quantity, 15)
+        with transaction.atomic():
+            reserve_stock(product, 12)
+
+
+
+
+class StockAsOfTests(StockTestCase):
+    def at(self, hours):
+        return mock.patch('django.utils.timezone.now', return_value=self.start + datetime.timedelta(hours=hours))
+
+    def setUp(self):
+        self.start = timezone.now() - datetime.timedelta(days=10)
+        with self.at(1):
+            self.product = create_stock({self.w1: 10, self.w2: 5})
+        with self.at(2), transaction.atomic():
+            reserve_stock(self.product, 12)
+        with self.at(3):
+            ProductWarehouse.objects.get(product=self.product, warehouse=self.w2).delete()
+        with self.at(4):
+            Delivery.objects.create(product=self.product, supplier=self.supplier, warehouse=self.w2, quantity=4, date=datetime.date.today())
+        self.other = create_stock({self.w1: 7})
+
+    def check_timeline(self):
+        p, w1, w2 = self.product.pk, self.w1.pk, self.w2.pk
+        expected = [
+            (0, {}),
+            (1, {(p, w1): 10, (p, w2): 5}),
+            (2.5, {(p, w1): 0, (p, w2): 3}),
+            (3, {(p, w1): 0}),
+            (4.5, {(p, w1): 0, (p, w2): 4}),
+        ]
+        for hours, stock in expected:
+            self.assertEqual(stock_as_of(self.start + datetime.timedelta(hours=hours), product_ids=[p]), stock, hours)
+        now = timezone.now()
+        self.assertEqual(stock_as_of(now), {(p, w1): 0, (p, w2): 4, (self.other.pk, w1): 7})
+        self.assertEqual(stock_as_of(now, warehouse_ids=[w2]), {(p, w2): 4})
+
+    def test_correlated_subquery(self):
+        with mock.patch.object(connection.features, 'can_distinct_on_fields', False):
+            self.check_timeline()
+
+    @unittest.skipUnless(connection.features.can_distinct_on_fields, 'Needs DISTINCT ON, that is Postgres')
+    def test_distinct_on(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.check_timeline()
+        self.assertIn('DISTINCT ON', queries[0]['sql'])
+
+
+class RollupTests(StockTestCase):
+    def test_rollup_rows_are_updated_in_key_order(self):
+        category = Category.objects.create(name='Мебель', summary='Мебель')
+        product = create_stock({self.w1: 5, self.w2: 5})
+        Category_Product.objects.create(category=category, product=product)
+        with CaptureQueriesContext(connection) as queries:
+            apply_stock_deltas({(product.pk, self.w2.pk): 1, (product.pk, self.w1.pk): -1})
+        updated = [
+            tuple(None if value == ' IS NULL' else int(value[3:]) for value in match)
+            for query in queries if query['sql'].startswith('UPDATE "management_stockrollup"')
+            for match in re.findall(r'"category_id"( IS NULL| = \d+) AND "management_stockrollup"."warehouse_id"( IS NULL| = \d+)', query['sql'])
+        ]
+        self.assertEqual(updated, [(None, self.w1.pk), (None, self.w2.pk), (category.pk, self.w1.pk), (category.pk, self.w2.pk)])
+
+
+class PlaceOrderTests(StockTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('buyer')
+        self.product = create_stock({self.w1: 10, self.w2: 5})
+
+    def place_order(self, **data):
+        return self.client.post('/api/orders/place_order/', {'product': self.product.pk, 'user': self.user.pk, **data}, format='json')
+
+    def test_reserves_from_the_requested_warehouse(self):
+        response = self.place_order(quantity=4, warehouse=self.w2.pk)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertNotIn('warehouse', response.data)
+        self.assertEqual(self.stock(self.product), {self.w1.pk: 10, self.w2.pk: 1})
+
+    def test_invalid_warehouse_is_a_bad_request(self):
+        for warehouse in ('abc', 999):
+            response = self.place_order(quantity=1, warehouse=warehouse)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('warehouse', response.data)
+        self.assertEqual(self.stock(self.product), {self.w1.pk: 10, self.w2.pk: 5})
+
+    def test_insufficient_stock_is_a_conflict(self):
+        response = self.place_order(quantity=6, warehouse=self.w2.pk)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.stock(self.product), {self.w1.pk: 10, self.w2.pk: 5})
+
+
+class ConcurrentReservationTests(TransactionTestCase):
+    THREADS = 8
+    ORDERS_PER_THREAD = 10
+
+    def test_parallel_orders_never_oversell(self):
+        w1 = Warehouse.objects.create(name='Склад 1', address='ул. Складская, 1')
+        w2 = Warehouse.objects.create(name='Склад 2', address='ул. Складская, 2')
+        product = create_stock({w1: 20, w2: 10})
+        sold = []
+
+        def buy(index):
+            rng = random.Random(index)
+
+            def order():
+                with transaction.atomic():
+                    reserve_stock(product, 1)
+
+            for _ in range(self.ORDERS_PER_THREAD):
+                try:
+                    retry_locked(order, rng)
+                except InsufficientStock:
+                    continue
+                sold.append(1)
+
+        start = time.perf_counter()
+        run_in_threads(self.THREADS, buy)
+        elapsed = time.perf_counter() - start
+
+        stock = dict(ProductWarehouse.objects.filter(product=product).values_list('warehouse_id', 'quantity'))
+        product.refresh_from_db()
+        # 80 orders for 30 units: all 30 sell, none twice, and no row goes below zero.
+        self.assertEqual(len(sold), 30, f'{len(sold)} orders in {elapsed:.2f}s')
+        self.assertEqual(stock, {w1.pk: 0, w2.pk: 0})
+        self.assertEqual(product.quantity, 0)
+
+
+
+class ConcurrentTransferTests(TransactionTestCase):
+    THREADS = 4
+    TRANSFERS_PER_THREAD = 10
+    LINES = 5
+    PRODUCTS = 10
+    STOCK = 100
+    # At most THREADS * TRANSFERS_PER_THREAD * MOVE units leave a row, less than STOCK,
+    # so no transfer can run short and every one of them must apply.
+    MOVE = 2
+
+    def test_opposing_transfers_all_apply_and_conserve_stock(self):
+        warehouses = [Warehouse.objects.create(name=f'Склад {i}', address=f'ул. Складская, {i}') for i in range(2)]
+        products = [
+            create_stock({warehouse: self.STOCK for warehouse in warehouses}, name=f'Стол {i}').pk
+            for i in range(self.PRODUCTS)
+        ]
+        warehouse_ids = [warehouse.pk for warehouse in warehouses]
+        applied = []
+
+        def transfer(index):
+            rng = random.Random(index)
+            for _ in range(self.TRANSFERS_PER_THREAD):
+                # Every transfer moves some products one way and others back, so
+                # concurrent transfers lock the same rows from both sides.
+                lines = [
+                    (product_id, *rng.sample(warehouse_ids, 2), rng.randint(1, self.MOVE))
+                    for product_id in rng.sample(products, self.LINES)
+                ]
+                retry_locked(lambda: transfer_stock(lines), rng)
+                applied.append(1)
+
+        # InsufficientStock, a deadlock or running out of retries is re-raised by run_in_threads.
+        start = time.perf_counter()
+        run_in_threads(self.THREADS, transfer)
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(len(applied), self.THREADS * self.TRANSFERS_PER_THREAD, f'{len(applied)} transfers in {elapsed:.2f}s')
+        totals = dict(
+            ProductWarehouse.objects.filter(product_id__in=products)
+            .values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total')
+        )
+        self.assertEqual(totals, {product_id: self.STOCK * len(warehouses) for product_id in products})
+        self.assertEqual(check_rollup(), {})
+        self.assertEqual(check_ledger(), {})
+
+
+
+# The manifest storage needs collectstatic, which the tests do not run.
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ConditionalResponseTests(StockTestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.product = create_stock({self.w1: 5})
+        self.api = f'/api/products/{self.product.pk}/'
+
+    def test_matching_etag_or_unchanged_date_is_not_modified(self):
+        for url in (self.api, f'/product/{self.product.pk}/'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_a_change_invalidates_the_validators(self):
+        response = self.client.get(self.api)
+        # History dates have sub-second precision, Last-Modified only whole seconds.
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + datetime.timedelta(seconds=2)):
+            self.product.name = 'Стол дубовый'
+            self.product.save()
+        changed = self.client.get(self.api, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.data['name'], 'Стол дубовый')
+        self.assertEqual(self.client.get(self.api, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 200)
+
+    def test_each_format_has_its_own_etag(self):
+        as_json = self.client.get(self.api, HTTP_ACCEPT='application/json')
+        as_html = self.client.get(self.api, HTTP_ACCEPT='text/html')
+        self.assertNotEqual(as_json['ETag'], as_html['ETag'])
+        self.assertIn('Accept', as_json['Vary'])
+        self.assertEqual(self.client.get(self.api, HTTP_ACCEPT='text/html', HTTP_IF_NONE_MATCH=as_json['ETag']).status_code, 200)
+
+    def test_invalid_pk_is_not_found(self):
+        for url in ('/api/products/abc/', '/api/orders/abc/', '/api/deliveries/abc/'):
+            self.assertEqual(self.client.get(url).status_code, 404, url)
+
+
+
+class CachedResponseTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.warehouse = Warehouse.objects.create(name='Север', address='ул. Складская, 1')
+        self.urls = ['/api/warehouses/', f'/api/warehouses/{self.warehouse.pk}/']
+
+    def test_second_get_is_served_from_the_cache(self):
+        for url in self.urls:
+            first = self.client.get(url)
+            self.assertEqual(first.status_code, 200)
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual((second.status_code, second.content, second['ETag']), (200, first.content, first['ETag']))
+
+    def test_matching_etag_is_not_modified(self):
+        for url in self.urls:
+            etag = self.client.get(url)['ETag']
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+
+    def test_committed_write_bumps_the_generation(self):
+        before = [self.client.get(url) for url in self.urls]
+        generation = get_generation(Warehouse)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.patch(self.urls[1], {'name': 'Юг'}, format='json').status_code, 200)
+        self.assertNotEqual(get_generation(Warehouse), generation)
+        for url, response in zip(self.urls, before):
+            changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(changed.status_code, 200)
+            self.assertNotEqual(changed['ETag'], response['ETag'])
+            self.assertIn('Юг', changed.content.decode())
+
+    def test_rolled_back_write_keeps_the_generation(self):
+        before = self.client.get(self.urls[1])
+        generation = get_generation(Warehouse)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(DatabaseError), transaction.atomic():
+                self.warehouse.name = 'Юг'
+                self.warehouse.save()
+                raise DatabaseError
+        self.assertEqual(callbacks, [])
+        self.assertEqual(get_generation(Warehouse), generation)
+        self.assertEqual(self.client.get(self.urls[1], HTTP_IF_NONE_MATCH=before['ETag']).status_code, 304)
+
+
+class DashboardCountsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_warm_cache_makes_no_queries(self):
+        with self.assertNumQueries(1):
+            counts = get_dashboard_counts()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_dashboard_counts(), counts)
+
+    def test_counts_are_invalidated_after_commit(self):
+        self.assertEqual(get_dashboard_counts()['num_warehouses'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Warehouse.objects.create(name='Склад 1', address='ул. Складская, 1')
+            # Still cached until the transaction commits, so no reader can cache the old count after it.
+            with self.assertNumQueries(0):
+                self.assertEqual(get_dashboard_counts()['num_warehouses'], 0)
+        self.assertEqual(get_dashboard_counts()['num_warehouses'], 1)
+
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'Checks the SQLite FTS5 search')
+class ProductSearchTests(TestCase):
+    def test_fts_table_is_looked_up_once_per_connection(self):
+        table = create_stock({}, name='Стол дубовый')
+        chair = create_stock({}, name='Стул')
+        self.assertEqual(list(search_products(Product.objects.all(), 'сто дуб')), [table])
+        with self.assertNumQueries(1):
+            self.assertEqual(list(search_products(Product.objects.all(), 'стул')), [chair])
+
+
+# The manifest storage needs collectstatic, which the tests do not run.
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class SearchRankTests(TestCase):
+    def setUp(self):
+        # Created first, so ordering by pk alone would put the weaker match on top.
+        self.weak = Product.objects.create(name='Шкаф', summary='Ставится у стола, рядом с креслом, диваном и комодом', price=10, quantity=0)
+        self.strong = Product.objects.create(name='Стол', summary='стол обеденный', price=10, quantity=0)
+        Product.objects.create(name='Стул', summary='Стул', price=10, quantity=0)
+
+    @unittest.skipUnless(connection.vendor in ('sqlite', 'postgresql'), 'Ranks with bm25() or ts_rank')
+    def test_better_matches_rank_higher(self):
+        products = search_products(Product.objects.all(), 'стол')
+        self.assertEqual(list(ranked(products)), [self.strong, self.weak])
+        ranks = dict(products.values_list('pk', 'search_rank'))
+        self.assertGreater(ranks[self.strong.pk], ranks[self.weak.pk])
+
+    def test_fallback_ranks_equally_and_orders_by_pk(self):
+        with mock.patch('management.search.sqlite_fts_available', return_value=False):
+            products = ranked(search_products(Product.objects.all(), 'стол'))
+            self.assertEqual([(product, product.search_rank) for product in products], [(self.weak, 0.0), (self.strong, 0.0)])
+
+    @unittest.skipUnless(connection.vendor in ('sqlite', 'postgresql'), 'Ranks with bm25() or ts_rank')
+    def test_api_pages_search_results_by_rank(self):
+        client = APIClient()
+        page, ids = client.get('/api/products/', {'search': 'стол', 'page_size': 1}).data, []
+        while True:
+            ids += [product['id'] for product in page['results']]
+            if not page['next']:
+                break
+            page = client.get(page['next']).data
+        self.assertEqual(ids, [self.strong.pk, self.weak.pk])
+        self.assertEqual([product['id'] for product in client.get('/api/products/', {'search': 'стол'}).data['results']], ids)
+
+    @unittest.skipUnless(connection.vendor in ('sqlite', 'postgresql'), 'Ranks with bm25() or ts_rank')
+    def test_admin_orders_search_results_by_rank(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+        response = self.client.get('/admin/management/product/', {'q': 'стол'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.strong, self.weak])
+
+
+
+class DeferredHistoryTests(TestCase):
+    def create_warehouse(self, name):
+        return Warehouse.objects.create(name=name, address='ул. Складская, 1')
+
+    def history_names(self):
+        return sorted(Warehouse.history.values_list('name', flat=True))
+
+    def test_history_is_written_inside_the_transaction_without_rolled_back_blocks(self):
+        # No on_commit callback is run here: the records must be there before the commit.
+        with deferred_history():
+            self.create_warehouse('Склад 1')
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    self.create_warehouse('Склад 2')
+                    raise ValueError
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    # Released into the block above, then rolled back with it.
+                    with transaction.atomic():
+                        self.create_warehouse('Склад 3')
+                    raise ValueError
+            self.create_warehouse('Склад 4')
+            self.assertEqual(self.history_names(), [])
+        self.assertEqual(self.history_names(), ['Склад 1', 'Склад 4'])
+
+    def test_a_failing_flush_rolls_back_the_changes(self):
+        # Creating a warehouse bulk inserts nothing but its history.
+        with mock.patch.object(QuerySet, 'bulk_create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                with deferred_history():
+                    self.create_warehouse('Склад 1')
+        self.assertFalse(Warehouse.objects.exists())
+        self.assertEqual(self.history_names(), [])
+
+    def test_nothing_is_written_when_the_transaction_rolls_back(self):
+        with self.assertRaises(ValueError):
+            with deferred_history():
+                self.create_warehouse('Склад 1')
+                raise ValueError
+        self.assertEqual(self.history_names(), [])
+
+
+class InstrumentationTests(StockTestCase):
+    def setUp(self):
+        route_stats.reset()
+        self.addCleanup(route_stats.reset)
+
+    def test_serialization_is_timed_for_serializers_and_fast_lists(self):
+        product = create_stock({self.w1: 5})
+        for url in ('/api/products/', f'/api/products/{product.pk}/'):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        snapshot = route_stats.snapshot()
+        for route in ('ProductViewSet.list', 'ProductViewSet.retrieve'):
+            self.assertGreater(snapshot[route]['serialize_seconds'][0.5], 0, route)
+            self.assertLess(snapshot[route]['serialize_seconds'][0.5], snapshot[route]['total_seconds'][0.5], route)
+
+
+
+
+class HistoryRetentionTests(TestCase):
+    def setUp(self):
+        # Noon, so that a few hours back is still the same day.
+        self.now = timezone.localtime().replace(hour=12, minute=0, second=0, microsecond=0)
+
+    def days_ago(self, days, hours=0):
+        return self.now - datetime.timedelta(days=days, hours=hours)
+
+    def test_redundant_history_ids(self):
+        day, next_day = self.days_ago(10), self.days_ago(9)
+        rows = [
+            (1, 1, day, '+'), (2, 1, day + datetime.timedelta(minutes=1), '~'), (3, 1, next_day, '~'),
+            (4, 2, day, '+'), (5, 2, day + datetime.timedelta(minutes=1), '-'),
+            (6, 3, day, '+'),
+        ]
+        # The last record of the day stands for the whole day, a deletion included.
+        self.assertEqual(list(_redundant_history_ids(rows, 'day')), [1, 4])
+        # Only the last record of each object is kept, and nothing of deleted objects.
+        self.assertEqual(list(_redundant_history_ids(rows, 'object')), [1, 2, 4, 5])
+
+    def warehouse_with_history(self, name, dates):
+        """A warehouse saved len(dates) times, its history records dated dates (oldest first)."""
+        warehouse = Warehouse.objects.create(name=name, address='ул. Складская, 1')
+        for i in range(len(dates) - 1):
+            warehouse.address = f'ул. Складская, {i + 2}'
+            warehouse.save()
+        records = Warehouse.history.filter(id=warehouse.pk).order_by('history_id')
+        for record, date in zip(records, dates):
+            Warehouse.history.filter(history_id=record.history_id).update(history_date=date)
+        return warehouse
+
+    def history(self, warehouse):
+        return list(Warehouse.history.filter(id=warehouse.pk).order_by('history_date').values_list('history_type', 'address'))
+
+    def test_keep_day_keeps_the_last_record_of_each_day(self):
+        warehouse = self.warehouse_with_history('Север', [self.days_ago(10, 2), self.days_ago(10, 1), self.days_ago(9), self.days_ago(1)])
+        self.assertEqual(compact_history(Warehouse.history.model, self.days_ago(5), keep='day'), 1)
+        # The record after the cutoff is never looked at.
+        self.assertEqual(self.history(warehouse), [('~', 'ул. Складская, 2'), ('~', 'ул. Складская, 3'), ('~', 'ул. Складская, 4')])
+
+    def test_keep_object_keeps_the_last_record_before_the_cutoff(self):
+        warehouse = self.warehouse_with_history('Север', [self.days_ago(10, 2), self.days_ago(10, 1), self.days_ago(9), self.days_ago(1)])
+        self.assertEqual(compact_history(Warehouse.history.model, self.days_ago(5), keep='object'), 2)
+        self.assertEqual(self.history(warehouse), [('~', 'ул. Складская, 3'), ('~', 'ул. Складская, 4')])
+
+    def test_deletions_survive(self):
+        deleted_today = self.warehouse_with_history('Север', [self.days_ago(10), self.days_ago(9)])
+        deleted_long_ago = self.warehouse_with_history('Юг', [self.days_ago(10), self.days_ago(9, 2)])
+        for warehouse in (deleted_today, deleted_long_ago):
+            pk = warehouse.pk
+            warehouse.delete()
+            warehouse.pk = pk
+        Warehouse.history.filter(id=deleted_long_ago.pk, history_type='-').update(history_date=self.days_ago(9, 1))
+
+        self.assertEqual(compact_history(Warehouse.history.model, self.days_ago(5), keep='day'), 1)
+        self.assertEqual(self.history(deleted_today), [('+', 'ул. Складская, 1'), ('~', 'ул. Складская, 2'), ('-', 'ул. Складская, 2')])
+        self.assertEqual(self.history(deleted_long_ago), [('+', 'ул. Складская, 1'), ('-', 'ул. Складская, 2')])
+        # keep='object' drops objects deleted before the cutoff, but not ones deleted after it.
+        self.assertEqual(compact_history(Warehouse.history.model, self.days_ago(5), keep='object'), 3)
+        self.assertEqual(self.history(deleted_today), [('~', 'ул. Складская, 2'), ('-', 'ул. Складская, 2')])
+        self.assertEqual(self.history(deleted_long_ago), [])
+
+    def test_deletes_in_batches(self):
+        warehouses = [
+            self.warehouse_with_history(f'Склад {i}', [self.days_ago(30), self.days_ago(20), self.days_ago(10)])
+            for i in range(5)
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(compact_history(Warehouse.history.model, self.days_ago(5), keep='object', batch_size=2, dry_run=True), 10)
+        self.assertFalse([query for query in queries if query['sql'].startswith('DELETE')])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(compact_history(Warehouse.history.model, self.days_ago(5), keep='object', batch_size=2), 10)
+        deletes = [query['sql'] for query in queries if query['sql'].startswith('DELETE')]
+        # Two objects per batch, so three batches of four, four and two records, deleted two at a time.
+        self.assertEqual(len(deletes), 5)
+        self.assertEqual([self.history(warehouse) for warehouse in warehouses], [[('~', 'ул. Складская, 3')]] * 5)
+
+
+class SeedDataTests(TestCase):
+    def test_seeded_stock_is_consistent(self):
+        seed_data(random.Random(0), products=30, warehouses=3, categories=3, suppliers=3, users=3, orders=20, deliveries=20)
+        self.assertEqual(post_deliveries(Delivery.objects.all()), 0)
+        stocked = dict(ProductWarehouse.objects.values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total'))
+        self.assertEqual(stocked, dict(Product.objects.values_list('pk', 'quantity')))
+        self.assertEqual(check_rollup(), {})
+        self.assertEqual(check_ledger(), {})
+
+
+
+class BulkImportTests(TestCase):
+    def row(self, pk, name):
+        return {'id': pk, 'name': name, 'summary': name, 'price': '10.00', 'quantity': '0'}
+
+    def test_repeated_ids_are_row_errors(self):
+        rows = [self.row(1, 'Стол'), self.row(2, 'Стул'), self.row(1, 'Шкаф'), self.row(2, 'Полка')]
+        # Once with both copies in one chunk, once with them in different chunks.
+        for chunk_size in (4, 2):
+            result = bulk_import(ProductResource, rows, chunk_size=chunk_size)
+            self.assertEqual([number for number, _ in result.errors], [3, 4])
+            self.assertEqual(result.errors[0][1], {'id': ['Duplicate of row 1.']})
+            self.assertFalse(Product.objects.exists())
+
+        result = bulk_import(ProductResource, rows, skip_errors=True)
+        self.assertEqual(result.new, 2)
+        self.assertEqual(dict(Product.objects.values_list('pk', 'name')), {1: 'Стол', 2: 'Стул'})
+
+    def test_diff_is_only_collected_on_request(self):
+        Product.objects.create(id=1, name='Стол', summary='Стол', price=10, quantity=0)
+        rows = [self.row(1, 'Стол дубовый'), self.row(2, 'Стул')]
+        self.assertEqual(bulk_import(ProductResource, rows, dry_run=True).diff, [])
+        result = bulk_import(ProductResource, rows, dry_run=True, diff=True)
+        self.assertEqual([(number, kind) for number, kind, _ in result.diff], [(1, 'update'), (2, 'new')])
+        self.assertEqual(result.diff[0][2], {'name': ('Стол', 'Стол дубовый'), 'summary': ('Стол', 'Стол дубовый')})
+
+
+
+
+class BulkEndpointTests(StockTestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def suppliers(self, count, start=0):
+        return [
+            {'name': f'ООО Поставщик {i}', 'contact': 'Иванов', 'address': 'ул. Заводская, 1', 'tel': f'+7 900 000 00 {i:02}'}
+            for i in range(start, start + count)
+        ]
+
+    def test_invalid_items_do_not_stop_the_valid_ones(self):
+        items = self.suppliers(3)
+        items[1]['tel'] = '+7' * 20
+        response = self.client.post('/api/suppliers/bulk/', items, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([error and list(error) for error in response.data['errors']], [{}, ['tel'], {}])
+        self.assertEqual([supplier['name'] for supplier in response.data['results']], [items[0]['name'], items[2]['name']])
+        self.assertEqual(
+            sorted(Supplier.objects.exclude(pk=self.supplier.pk).values_list('name', flat=True)),
+            [items[0]['name'], items[2]['name']],
+        )
+
+        response = self.client.post('/api/suppliers/bulk/', [items[1]], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.data[0]), ['tel'])
+        self.assertEqual(self.client.post('/api/suppliers/bulk/', {'name': 'x'}, format='json').status_code, 400)
+
+    def test_idempotency_keys_follow_the_submitted_positions(self):
+        product = create_stock({self.w1: 10})
+        item = {'product': product.pk, 'supplier': self.supplier.pk, 'warehouse': self.w1.pk, 'quantity': 5, 'date': '2026-01-01'}
+        items = [item, {**item, 'quantity': -1}, item]
+        response = self.client.post('/api/deliveries/bulk/', items, format='json', HTTP_IDEMPOTENCY_KEY='batch')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(sorted(Delivery.objects.values_list('idempotency_key', flat=True)), ['batch:0', 'batch:2'])
+        self.assertEqual(self.stock(product), {self.w1.pk: 20})
+
+    def test_every_created_object_gets_a_history_record(self):
+        response = self.client.post('/api/suppliers/bulk/', self.suppliers(3), format='json')
+        self.assertEqual(response.status_code, 201)
+        ids = [supplier['id'] for supplier in response.data]
+        self.assertEqual(sorted(Supplier.history.filter(history_type='+', id__in=ids).values_list('id', flat=True)), sorted(ids))
+
+    def test_queries_do_not_grow_with_the_items(self):
+        counts = []
+        for start, count in ((0, 2), (2, 40)):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/api/suppliers/bulk/', self.suppliers(count, start), format='json')
+            self.assertEqual(response.status_code, 201)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+
+# The manifest storage needs collectstatic, which the tests do not run.
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class StreamingExportTests(StockTestCase):
+    url = '/admin/management/product/export/'
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+        self.products = [create_stock({self.w1: i}, name=f'Стол «{i}»') for i in range(3)]
+        self.model_admin = site._registry[Product]
+        formats = self.model_admin.get_export_formats()
+        self.csv = next(i for i, file_format in enumerate(formats) if file_format().get_extension() == 'csv')
+
+    def export(self):
+        response = self.client.post(self.url, {'file_format': self.csv})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def read_back(self, content, encoding):
+        rows = list(csv.DictReader(io.StringIO(content.decode(encoding))))
+        # In the changelist order, newest first.
+        self.assertEqual([(int(row['id']), row['name'], int(row['quantity'])) for row in reversed(rows)], [
+            (product.pk, product.name, product.quantity) for product in self.products
+        ])
+
+    def test_csv_reads_back(self):
+        response, content = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.read_back(content, 'utf-8')
+
+    def test_to_encoding(self):
+        with mock.patch.object(self.model_admin, 'to_encoding', 'cp1251', create=True):
+            response, content = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=cp1251')
+        self.read_back(content, 'cp1251')
+
+    def test_overridden_get_export_form_is_used(self):
+        forms = []
+
+        class Form(ExportForm):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                forms.append(self)
+
+        with mock.patch.object(self.model_admin, 'get_export_form', lambda: Form, create=True):
+            self.read_back(self.export()[1], 'utf-8')
+        self.assertEqual(len(forms), 1)
+
+
+class KeysetPaginationTests(StockTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.products = [create_stock({self.w1: i, self.w2: 1}, name=f'Стол {i}') for i in range(5)]
+
+    def ids(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [product['id'] for product in response.data['results']]
+
+    def test_pages_stay_put_when_rows_are_added_and_removed(self):
+        first = self.client.get('/api/products/', {'page_size': 2})
+        self.assertEqual(self.ids(first), [product.pk for product in self.products[:2]])
+        # With offsets, deleting a row already shown would skip one.
+        self.products[0].delete()
+        added = create_stock({self.w1: 1}, name='Стол новый')
+        second = self.client.get(first.data['next'])
+        self.assertEqual(self.ids(second), [product.pk for product in self.products[2:4]])
+        third = self.client.get(second.data['next'])
+        self.assertEqual(self.ids(third), [self.products[4].pk, added.pk])
+        self.assertIsNone(third.data['next'])
+
+    def test_cursor_round_trip(self):
+        first = self.client.get('/api/products/', {'page_size': 2})
+        second = self.client.get(first.data['next'])
+        self.assertEqual(self.ids(self.client.get(second.data['previous'])), self.ids(first))
+        self.assertEqual(self.ids(self.client.get(second.data['next'])), [self.products[4].pk])
+        self.assertIsNone(first.data['previous'])
+
+    def test_count_only_on_request(self):
+        self.assertNotIn('count', self.client.get('/api/products/').data)
+        self.assertEqual(self.client.get('/api/products/', {'count': 'exact'}).data['count'], 5)
+        self.assertEqual(self.client.get('/api/products/', {'count': 'approx'}).data['count'], 5)
+
+
+class NDJSONTests(StockTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        category = Category.objects.create(name='Мебель', summary='Мебель')
+        user = User.objects.create_user('buyer')
+        for i in range(7):
+            product = create_stock({self.w1: i, self.w2: 1} if i % 2 else {self.w1: i}, name=f'Стол {i}')
+            if i % 3:
+                Category_Product.objects.create(category=category, product=product)
+            Order.objects.create(product=product, user=user, quantity=i, status='PENDING')
+
+    def json_pages(self, url):
+        items, page = [], self.client.get(url, {'page_size': 3}, HTTP_ACCEPT='application/json').data
+        while True:
+            items += page['results']
+            if not page['next']:
+                return items
+            page = self.client.get(page['next'], HTTP_ACCEPT='application/json').data
+
+    def test_stream_matches_the_json_pages(self):
+        for url in ('/api/products/filter_products/', '/api/orders/filter_orders/'):
+            response = self.client.get(url, {'format': 'ndjson'})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+            lines = b''.join(response.streaming_content).decode().split('\n')
+            # Every item is on its own line, and the last line ends with a newline too.
+            self.assertEqual(lines.pop(), '')
+            expected = json.loads(json.dumps(self.json_pages(url), cls=JSONEncoder))
+            self.assertEqual(len(expected), 7)
+            self.assertEqual([json.loads(line) for line in lines], expected)
+
+    def test_chunks_with_and_without_fast_representation(self):
+        expected = json.loads(json.dumps(ProductSerializer(Product.objects.order_by('pk'), many=True).data, cls=JSONEncoder))
+        for representation in (None, FastRepresentation(ProductSerializer())):
+            lines = list(iter_ndjson(Product.objects.all(), ProductSerializer, chunk_size=2, representation=representation))
+            self.assertEqual([json.loads(line) for line in lines], expected)
+
+
+# The manifest storage needs collectstatic, which the tests do not run.
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ListViewQueryTests(StockTestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+
+    def create_rows(self, count):
+        product = create_stock({self.w1: 100})
+        user = User.objects.create_user(f'buyer {Order.objects.count()}')
+        for _ in range(count):
+            Order.objects.create(product=product, user=user, quantity=1, status='PENDING')
+            Delivery.objects.create(product=product, supplier=self.supplier, quantity=1, date=datetime.date.today())
+
+    def page_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_order_and_delivery_lists_load_relations_with_the_page(self):
+        self.create_rows(2)
+        urls = ['/orders/', '/deliveries/']
+        few = [self.page_queries(url) for url in urls]
+        self.create_rows(8)
+        self.assertEqual([self.page_queries(url) for url in urls], few)
+
+    def test_paginated_lists_are_ordered(self):
+        Category.objects.create(name='Мебель', summary='Мебель')
+        self.create_rows(1)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', UnorderedObjectListWarning)
+            for url in ('/product/', '/categories/', '/warehouses/', '/suppliers/', '/orders/', '/deliveries/'):
+                self.page_queries(url)
+
+
+# The manifest storage needs collectstatic, which the tests do not run.
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class AdminChangelistQueryTests(StockTestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_product_changelist_queries_do_not_grow_with_page_size(self):
+        for i in range(3):
+            create_stock({self.w1: i, self.w2: 1}, name=f'Стол {i}')
+        urls = ['/admin/management/product/', '/admin/management/product/?q=Стол']
+        # The first search on a connection also looks up the FTS table.
+        self.changelist_queries(urls[1])
+        few = [self.changelist_queries(url) for url in urls]
+        self.assertEqual(few[0], few[1])
+        for i in range(3, 60):
+            create_stock({self.w1: i, self.w2: 1}, name=f'Стол {i}')
+        self.assertEqual([self.changelist_queries(url) for url in urls], few)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'The plans below are SQLite query plans')
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class IndexUsageTests(StockTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.product = create_stock({cls.w1: 5, cls.w2: 5})
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        for status in ('PENDING', 'SHIPPED', 'CANCELLED'):
+            Order.objects.create(product=cls.product, user=cls.user, quantity=1, status=status, date=datetime.date.today())
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def explain(self, queries):
+        """The SQLite plans of the captured queries that read the management tables."""
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries:
+                if query['sql'].startswith('SELECT') and 'management_' in query['sql']:
+                    cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                    plans.extend(row[3] for row in cursor.fetchall())
+        return '\n'.join(plans)
+
+    def query_plans(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return self.explain(queries)
+
+    def test_admin_date_filters_use_the_date_indexes(self):
+        today = datetime.date.today()
+        dates = f'date__gte={today}&date__lt={today + datetime.timedelta(days=1)}'
+        self.assertIn('INDEX order_date (date>? AND date<?)', self.query_plans(f'/admin/management/order/?{dates}'))
+        self.assertIn('INDEX delivery_date (date>? AND date<?)', self.query_plans(f'/admin/management/delivery/?{dates}'))
+
+    def test_admin_status_filter_uses_the_status_date_index(self):
+        self.assertIn('INDEX order_status_date (status=?)', self.query_plans('/admin/management/order/?status__exact=PENDING'))
+        today = datetime.date.today()
+        self.assertIn(
+            'INDEX order_status_date (status=? AND date>? AND date<?)',
+            self.query_plans(f'/admin/management/order/?status__exact=PENDING&date__gte={today}&date__lt={today + datetime.timedelta(days=1)}'),
+        )
+
+    def test_filter_products_reads_warehouse_rows_by_warehouse(self):
+        self.assertIn(
+            'INDEX productwarehouse_wh_product (warehouse_id=?)',
+            self.query_plans('/api/products/filter_products/?price=5'),
+        )
+
+    def test_stock_balances_read_unfolded_movements_by_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            stock_balances(product_ids=[self.product.pk])
+        self.assertIn('INDEX stockmovement_unfolded', self.explain(queries))
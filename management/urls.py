@@ -14,6 +14,7 @@ router.register(r'suppliers', SupplierViewSet)
 
 urlpatterns = [
     path('', views.index, name='index'),
+    path('metrics/', views.metrics, name='metrics'),
 
     path('api/', include(router.urls)),
 
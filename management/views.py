@@ -1,33 +1,40 @@
-from django.db.models import Q
+from functools import partial
+
+from django.db import IntegrityError, transaction
+from django.db.models import OuterRef, Q
 from django.views import generic
 from django.shortcuts import render, redirect
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.mixins import PermissionRequiredMixin
+from django.contrib.admin.views.decorators import staff_member_required
 from django.views.generic import ListView, CreateView, UpdateView, DetailView, DeleteView
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
-from rest_framework.filters import SearchFilter
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
-from .models import Product, Category, Category_Product, Warehouse, Order, Delivery, Supplier
+from .models import Product, Category, Category_Product, Warehouse, ProductWarehouse, Order, Delivery, Supplier, StockRollup
 from django.urls import reverse_lazy
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
 import datetime
 
-from .pagination import ProductsPagination
+from .bulk import BulkModelViewSetMixin
+from .caching import CachedResponseMixin
+from .conditional import ConditionalDetailMixin, ConditionalRetrieveMixin
+from .fast import FastListMixin
+from .instrumentation import SerializationTimingMixin, prometheus_text, route_stats
+from .counters import get_dashboard_counts
+from .pagination import KeysetPagination, ProductsPagination
+from .renderers import NDJSON_RENDERER_CLASSES, ndjson_response
+from .search import ProductSearchFilter
+from .stock import InsufficientStock, reserve_stock, stock_as_of, transfer_stock
 from .serializers import CategorySerializer, WarehouseSerializer, ProductSerializer, OrderSerializer, \
-  DeliverySerializer, SupplierSerializer
+  DeliverySerializer, SupplierSerializer, StockAsOfSerializer, TransferSerializer, PlaceOrderSerializer
 
 
 def index(request):
-    num_products = Product.objects.all().count()
-    num_categories = Category.objects.all().count()
-    num_suppliers = Supplier.objects.all().count()
-    num_orders = Order.objects.all().count()
-    num_deliveries = Delivery.objects.all().count()
-    num_warehouses = Warehouse.objects.all().count()
     num_visits = request.session.get('num_visits', 1)
     request.session['num_visits'] = num_visits + 1
 
@@ -35,23 +42,28 @@ def index(request):
         request,
         'index.html',
         context={
-            'num_products': num_products,
-            'num_categories': num_categories,
-            'num_suppliers': num_suppliers,
-            'num_orders': num_orders,
-            'num_deliveries': num_deliveries,
-            'num_warehouses': num_warehouses,
+            **get_dashboard_counts(),
             'num_visits': num_visits,
         },
     )
 
 
+@staff_member_required
+def metrics(request):
+    """Per-route request percentiles from InstrumentationMiddleware, as JSON or ?format=prometheus."""
+    snapshot = route_stats.snapshot()
+    if request.GET.get('format') == 'prometheus':
+        return HttpResponse(prometheus_text(snapshot), content_type='text/plain; version=0.0.4; charset=utf-8')
+    return JsonResponse(snapshot)
+
+
 # PRODUCT
 class ProductListView(ListView):
     model = Product
+    ordering = ['pk']
     paginate_by = 10
 
-class ProductDetailView(DetailView):
+class ProductDetailView(ConditionalDetailMixin, DetailView):
     model = Product
 
 class ProductCreateView(CreateView):
@@ -72,9 +84,10 @@ class ProductDeleteView(DeleteView):
 # CATEGORY
 class CategoryListView(ListView):
     model = Category
+    ordering = ['pk']
     paginate_by = 10
 
-class CategoryDetailView(DetailView):
+class CategoryDetailView(ConditionalDetailMixin, DetailView):
     model = Category
 
 class CategoryCreateView(CreateView):
@@ -95,13 +108,22 @@ class CategoryDeleteView(DeleteView):
 # WAREHOUSE
 class WarehouseListView(ListView):
     model = Warehouse
+    ordering = ['pk']
     paginate_by = 10
     template_name = 'warehouse_list.html'
     context_object_name = 'warehouse_list'
 
-class WarehouseDetailView(DetailView):
+class WarehouseDetailView(ConditionalDetailMixin, DetailView):
     model = Warehouse
 
+    def get_related_history(self):
+        # The page lists the names of the products stored in the warehouse.
+        products = ProductWarehouse.objects.filter(warehouse_id=OuterRef(OuterRef('pk'))).values('product_id')
+        return [
+            ProductWarehouse.history.filter(warehouse_id=OuterRef('pk')),
+            Product.history.filter(id__in=products),
+        ]
+
 class WarehouseCreateView(CreateView):
     model = Warehouse
     fields = ['name', 'address']
@@ -120,13 +142,17 @@ class WarehouseDeleteView(DeleteView):
 # ORDER
 class OrderListView(ListView):
     model = Order
+    queryset = Order.objects.select_related('product', 'user').order_by('pk')
     paginate_by = 10
     template_name = 'order_list.html'
     context_object_name = 'order_list'
 
-class OrderDetailView(DetailView):
+class OrderDetailView(ConditionalDetailMixin, DetailView):
     model = Order
 
+    def get_related_history(self):
+        return [Product.history.filter(id=OuterRef('product_id'))]
+
 class OrderCreateView(CreateView):
     model = Order
     fields = ['product', 'user', 'quantity', 'status']
@@ -145,23 +171,34 @@ class OrderDeleteView(DeleteView):
 # DELIVERY
 class DeliveryListView(ListView):
     model = Delivery
+    queryset = Delivery.objects.select_related('product', 'supplier').order_by('pk')
     paginate_by = 10
     template_name = 'delivery_list.html'
     context_object_name = 'delivery_list'
 
-class DeliveryDetailView(DetailView):
+class DeliveryDetailView(ConditionalDetailMixin, DetailView):
     model = Delivery
 
+    def get_related_history(self):
+        return [Supplier.history.filter(id=OuterRef('supplier_id'))]
+
 class DeliveryCreateView(CreateView):
     model = Delivery
-    fields = ['product', 'supplier', 'quantity', 'date']
+    fields = ['product', 'supplier', 'warehouse', 'quantity', 'date']
     permission_required = 'management.can_mark_returned'
 
 class DeliveryUpdateView(UpdateView):
     model = Delivery
-    fields = ['product', 'supplier', 'quantity', 'date']
+    fields = ['product', 'supplier', 'warehouse', 'quantity', 'date']
     permission_required = 'management.can_mark_returned'
 
+    def get_form(self, form_class=None):
+        form = super().get_form(form_class)
+        if self.object.posted_at is not None:
+            for name in Delivery.POSTED_FIELDS:
+                form.fields[name].disabled = True
+        return form
+
 class DeliveryDeleteView(DeleteView):
     model = Delivery
     success_url = reverse_lazy('deliveries')
@@ -170,11 +207,12 @@ class DeliveryDeleteView(DeleteView):
 # SUPPLIER
 class SupplierListView(ListView):
     model = Supplier
+    ordering = ['pk']
     paginate_by = 10
     template_name = 'supplier_list.html'
     context_object_name = 'supplier_list'
 
-class SupplierDetailView(DetailView):
+class SupplierDetailView(ConditionalDetailMixin, DetailView):
     model = Supplier
 
 class SupplierCreateView(CreateView):
@@ -193,52 +231,150 @@ class SupplierDeleteView(DeleteView):
     permission_required = 'management.can_mark_returned'
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(CachedResponseMixin, SerializationTimingMixin, FastListMixin, BulkModelViewSetMixin, viewsets.ModelViewSet):
   queryset = Category.objects.all()
   serializer_class = CategorySerializer
+  pagination_class = KeysetPagination
+
+  @action(methods=['GET'], detail=True)
+  def stock(self, request, pk=None):
+      category = self.get_object()
+      rows = StockRollup.objects.filter(category=category).values_list('warehouse_id', 'quantity')
+      warehouses = {warehouse_id: quantity for warehouse_id, quantity in rows}
+      return Response({
+          'category': category.pk,
+          'total_quantity': warehouses.pop(None, 0),
+          'warehouses': warehouses,
+      }, status=status.HTTP_200_OK)
 
 
-class WarehouseViewSet(viewsets.ModelViewSet):
+class WarehouseViewSet(CachedResponseMixin, SerializationTimingMixin, FastListMixin, BulkModelViewSetMixin, viewsets.ModelViewSet):
   queryset = Warehouse.objects.all()
   serializer_class = WarehouseSerializer
-
-
-class ProductViewSet(viewsets.ModelViewSet):
+  pagination_class = KeysetPagination
+
+  @action(methods=['GET'], detail=True)
+  def stock(self, request, pk=None):
+      warehouse = self.get_object()
+      rows = StockRollup.objects.filter(warehouse=warehouse).values_list('category_id', 'quantity')
+      categories = {category_id: quantity for category_id, quantity in rows}
+      return Response({
+          'warehouse': warehouse.pk,
+          'total_quantity': categories.pop(None, 0),
+          'categories': categories,
+      }, status=status.HTTP_200_OK)
+
+  @action(methods=['POST'], detail=False)
+  def transfer(self, request):
+      serializer = TransferSerializer(data=request.data)
+      serializer.is_valid(raise_exception=True)
+      lines = [
+          (line['product'], line['source'], line['destination'], line['quantity'])
+          for line in serializer.validated_data['lines']
+      ]
+      try:
+          deltas = transfer_stock(lines)
+      except InsufficientStock as e:
+          return Response({'detail': str(e)}, status=status.HTTP_409_CONFLICT)
+      return Response({
+          'lines': len(lines),
+          'stock': [
+              {'product': product_id, 'warehouse': warehouse_id, 'delta': delta}
+              for (product_id, warehouse_id), delta in sorted(deltas.items())
+          ],
+      }, status=status.HTTP_200_OK)
+
+
+class ProductViewSet(ConditionalRetrieveMixin, SerializationTimingMixin, FastListMixin, BulkModelViewSetMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     pagination_class = ProductsPagination
-    filter_backends = [SearchFilter]
+    filter_backends = [ProductSearchFilter]
     search_fields = ['name', 'summary']
 
-    @action(methods=['GET'], detail=False)
+    def get_related_history(self):
+        # The serializer includes the warehouse and category ids.
+        return [
+            ProductWarehouse.history.filter(product_id=OuterRef('pk')),
+            Category_Product.history.filter(product_id=OuterRef('pk')),
+        ]
+
+    @action(methods=['GET'], detail=False, renderer_classes=NDJSON_RENDERER_CLASSES)
     def filter_products(self, request):
         min_price = request.query_params.get('price')
         if min_price:
+            # A semi-join on warehouse 1 instead of joining warehouses, which repeated products.
+            in_warehouse = ProductWarehouse.objects.filter(warehouse_id=1).values('product_id')
             queryset = Product.objects.filter(
-                ~Q(price__lt=min_price) & Q(quantity__gt=0) | (Q(warehouses__id=1) & ~Q(price__lt=min_price))
+                ~Q(price__lt=min_price) & Q(quantity__gt=0) | (Q(pk__in=in_warehouse) & ~Q(price__lt=min_price))
             )
         else:
             queryset = Product.objects.all()
 
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
-
-
-class OrderViewSet(viewsets.ModelViewSet):
+        if request.accepted_renderer.format == 'ndjson':
+            return ndjson_response(queryset, self.get_serializer, self.get_fast_representation())
+        return self.fast_list_response(queryset)
+
+    @action(methods=['GET'], detail=False, url_path='stock-as-of')
+    def stock_as_of(self, request):
+        params = StockAsOfSerializer(data={
+            'date': request.query_params.get('date'),
+            'product': request.query_params.getlist('product'),
+            'warehouse': request.query_params.getlist('warehouse'),
+        })
+        params.is_valid(raise_exception=True)
+        stock = stock_as_of(
+            params.validated_data['date'],
+            product_ids=params.validated_data['product'] or None,
+            warehouse_ids=params.validated_data['warehouse'] or None,
+        )
+        return Response([
+            {'product': product_id, 'warehouse': warehouse_id, 'quantity': quantity}
+            for (product_id, warehouse_id), quantity in sorted(stock.items())
+        ], status=status.HTTP_200_OK)
+
+
+class OrderViewSet(ConditionalRetrieveMixin, SerializationTimingMixin, FastListMixin, BulkModelViewSetMixin, viewsets.ModelViewSet):
   queryset = Order.objects.all()
   serializer_class = OrderSerializer
+  pagination_class = KeysetPagination
   filter_backends = [DjangoFilterBackend]
   filterset_fields = ['status']
 
-  @action(methods=['GET'], detail=False)
+  @action(methods=['GET'], detail=False, renderer_classes=NDJSON_RENDERER_CLASSES)
   def filter_orders(self, request):
       min_quantity = request.query_params.get('quantity')
-      queryset = Order.objects.filter(
-          (Q(quantity__gte=min_quantity) & ~Q(status='CANCELLED')) | Q(status='PENDING')
-      )
-
-      serializer = self.get_serializer(queryset, many=True)
-      return Response(serializer.data, status=status.HTTP_200_OK)
+      if min_quantity:
+          queryset = Order.objects.filter(
+              (Q(quantity__gte=min_quantity) & ~Q(status='CANCELLED')) | Q(status='PENDING')
+          )
+      else:
+          queryset = Order.objects.exclude(status='CANCELLED')
+
+      if request.accepted_renderer.format == 'ndjson':
+          return ndjson_response(queryset, self.get_serializer, self.get_fast_representation())
+      return self.fast_list_response(queryset)
+
+  @action(methods=['POST'], detail=False, serializer_class=PlaceOrderSerializer)
+  def place_order(self, request):
+      data = request.data.copy()
+      data.setdefault('status', 'PENDING')
+      serializer = self.get_serializer(data=data)
+      serializer.is_valid(raise_exception=True)
+
+      warehouse = serializer.validated_data.get('warehouse')
+      try:
+          with transaction.atomic():
+              reserve_stock(
+                  serializer.validated_data['product'],
+                  serializer.validated_data['quantity'],
+                  warehouse=warehouse,
+              )
+              serializer.save()
+      except InsufficientStock as e:
+          return Response({'detail': str(e)}, status=status.HTTP_409_CONFLICT)
+
+      return Response(serializer.data, status=status.HTTP_201_CREATED)
 
   @action(methods=['POST'], detail=True)
   def mark_order_as_shipped(self, request, pk=None):
@@ -251,11 +387,71 @@ class OrderViewSet(viewsets.ModelViewSet):
       return Response(serializer.data, status=status.HTTP_200_OK)
 
 
-class DeliveryViewSet(viewsets.ModelViewSet):
-  queryset = Delivery.objects.all()
-  serializer_class = DeliverySerializer
+# Leaves room in Delivery.idempotency_key for the ':<index>' suffix of bulk items.
+IDEMPOTENCY_KEY_MAX_LENGTH = 80
 
 
-class SupplierViewSet(viewsets.ModelViewSet):
+class DeliveryViewSet(ConditionalRetrieveMixin, SerializationTimingMixin, FastListMixin, BulkModelViewSetMixin, viewsets.ModelViewSet):
+  """
+  POST with an Idempotency-Key header creates the delivery once: a retry with the same
+  key gets the delivery created the first time, with 200 instead of 201. On /bulk/ the
+  key covers the whole array.
+  """
+  queryset = Delivery.objects.all()
+  serializer_class = DeliverySerializer
+  pagination_class = KeysetPagination
+
+  def _idempotency_key(self):
+    key = self.request.headers.get('Idempotency-Key') or None
+    if key is not None and len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+      raise ValidationError({'Idempotency-Key': [f'Ensure this header has no more than {IDEMPOTENCY_KEY_MAX_LENGTH} characters.']})
+    return key
+
+  def _replay(self, keys, many):
+    found = Delivery.objects.in_bulk(keys, field_name='idempotency_key')
+    if not found:
+      return None
+    deliveries = [found[key] for key in keys if key in found]
+    serializer = self.get_serializer(deliveries, many=True) if many else self.get_serializer(deliveries[0])
+    return Response(serializer.data, status=status.HTTP_200_OK)
+
+  def _create_once(self, keys, many, create):
+    if not keys:
+      return create()
+    response = self._replay(keys, many)
+    if response is not None:
+      return response
+    try:
+      with transaction.atomic():
+        return create()
+    except IntegrityError:
+      # A concurrent request with the same key created the deliveries first.
+      response = self._replay(keys, many)
+      if response is None:
+        raise
+      return response
+
+  def create(self, request, *args, **kwargs):
+    key = self._idempotency_key()
+    return self._create_once([key] if key else [], False, partial(super().create, request, *args, **kwargs))
+
+  def perform_create(self, serializer):
+    serializer.save(idempotency_key=self._idempotency_key())
+
+  def bulk_create(self, request):
+    key = self._idempotency_key()
+    keys = [f'{key}:{i}' for i in range(len(request.data))] if key and isinstance(request.data, list) else []
+    return self._create_once(keys, True, partial(super().bulk_create, request))
+
+  def perform_bulk_create(self, serializer, positions):
+    key = self._idempotency_key()
+    if key:
+      for i, attrs in zip(positions, serializer.validated_data):
+        attrs['idempotency_key'] = f'{key}:{i}'
+    serializer.save()
+
+
+class SupplierViewSet(CachedResponseMixin, SerializationTimingMixin, FastListMixin, BulkModelViewSetMixin, viewsets.ModelViewSet):
   queryset = Supplier.objects.all()
   serializer_class = SupplierSerializer
+  pagination_class = KeysetPagination